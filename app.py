@@ -5,20 +5,35 @@ This module provides the application factory pattern for creating Flask app inst
 Routes are organized in separate blueprint modules in the routes package.
 """
 
-from flask import Flask
-from database import init_database, add_sample_data
+from flask import Flask, g
+import database
+import metrics
+import idempotency
+import profiling
+import query_stats
+from database import init_database, add_sample_data, get_db_connection, release_connection, configure_profile
 from routes import register_blueprints
 
 
-def create_app():
+def create_app(config=None):
     """
     Application factory function to create and configure Flask app.
     
+    Args:
+        config: Optional mapping of settings applied to app.config
+            (e.g. DB_PROFILE to pick a SQLite performance profile)
+    
     Returns:
         Flask: Configured Flask application instance
     """
     app = Flask(__name__)
     app.secret_key = "super secret key"
+    app.config['DB_PROFILE'] = database.DB_PROFILE
+    if config:
+        app.config.update(config)
+    
+    # Select the SQLite performance profile before any connection is opened
+    configure_profile(app.config['DB_PROFILE'])
     
     # Initialize the database
     init_database()
@@ -26,6 +41,30 @@ def create_app():
     # Add sample data for testing and demonstration
     add_sample_data()
     
+    # Request count, latency and error metrics for /metrics
+    metrics.init_app(app)
+    
+    # Per-request query counting with warnings for over-budget and N+1 requests
+    query_stats.init_app(app)
+    
+    # Opt-in cProfile of single requests (needs PROFILING_TOKEN)
+    profiling.init_app(app)
+    
+    # Hold one pooled connection for the whole request so every helper reuses it
+    @app.before_request
+    def lease_db_connection():
+        g.db_conn = get_db_connection()
+
+    @app.teardown_request
+    def release_db_connection(exc):
+        conn = g.pop('db_conn', None)
+        if conn is not None:
+            # Forced, so a lease leaked by a failing helper cannot strand the connection
+            release_connection(conn)
+    
+    # Retried borrow/return POSTs with the same Idempotency-Key get the first response back
+    idempotency.init_app(app)
+    
     # Register all route blueprints
     register_blueprints(app)
     
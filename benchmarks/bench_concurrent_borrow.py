@@ -0,0 +1,74 @@
+"""
+Stress benchmark: concurrent checkouts of the same titles.
+
+Many threads race to borrow a handful of books with few copies. Reports
+throughput and verifies that available_copies never goes negative and that
+the number of open loans matches the copies handed out.
+
+    python benchmarks/bench_concurrent_borrow.py [threads] [attempts_per_thread]
+"""
+
+import sys
+import threading
+import time
+
+from common import use_temp_database, remove_database
+
+import database
+from library_service import borrow_book_by_patron
+
+BOOKS = 10
+COPIES = 25
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    attempts = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    path = use_temp_database('concurrent')
+    database.configure_pool(size=threads)
+    conn = database.get_db_connection()
+    conn.executemany('''
+        INSERT INTO books (title, author, isbn, total_copies, available_copies)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ((f'Book {i}', 'Author', f'{i:013d}', COPIES, COPIES) for i in range(1, BOOKS + 1)))
+    conn.commit()
+    conn.close()
+
+    successes = [0] * threads
+
+    def worker(index):
+        for attempt in range(attempts):
+            patron_id = f'{index * attempts + attempt:06d}'
+            ok, _ = borrow_book_by_patron(patron_id, attempt % BOOKS + 1)
+            if ok:
+                successes[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    conn = database.get_db_connection()
+    min_available = conn.execute('SELECT MIN(available_copies) FROM books').fetchone()[0]
+    handed_out = conn.execute('SELECT SUM(total_copies - available_copies) FROM books').fetchone()[0]
+    loans = conn.execute('SELECT COUNT(*) FROM borrow_records WHERE return_date IS NULL').fetchone()[0]
+    conn.close()
+
+    total = threads * attempts
+    print(f'{total} borrow attempts on {threads} threads in {elapsed:.3f}s ({total / elapsed:,.0f} ops/s)')
+    print(f'successful borrows: {sum(successes)} (capacity {BOOKS * COPIES})')
+    print(f'open loans: {loans}, copies handed out: {handed_out}, min available_copies: {min_available}')
+
+    remove_database(path)
+    if min_available < 0 or loans != handed_out or sum(successes) != loans:
+        print('FAIL: availability drifted from the loan records')
+        sys.exit(1)
+    print('OK: no overselling')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Benchmark: connect-per-call vs pooled connections on the borrow path.
+
+    python benchmarks/bench_connection_pool.py [borrows]
+"""
+
+import sys
+
+from common import use_temp_database, seed_books, timed, remove_database
+
+import database
+from library_service import borrow_book_by_patron
+
+
+def run_borrows(count: int):
+    for i in range(count):
+        patron_id = f'{100000 + i % 50000:06d}'
+        borrow_book_by_patron(patron_id, i % 100 + 1)
+
+
+def main():
+    borrows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    for label, size in (('connect-per-call', 0), ('pooled', 5)):
+        path = use_temp_database('pool')
+        seed_books(100)
+        database.configure_pool(size=size)
+
+        elapsed = timed(run_borrows, borrows)
+
+        print(f'{label:>18}: {borrows} borrows in {elapsed:.3f}s '
+              f'({borrows / elapsed:,.0f} ops/s, {elapsed / borrows * 1e6:.1f} us/op)')
+        remove_database(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Benchmark: streaming catalog export memory use.
+
+Exports the catalog through catalog_io.export_books (discarding the output)
+and reports the tracemalloc peak next to get_all_books(), which materializes
+every row. The streaming peak should stay flat as the catalog grows.
+
+    python benchmarks/bench_export.py [sizes...]     (default: 100000 1000000)
+"""
+
+import sys
+import time
+import tracemalloc
+
+from common import use_temp_database, seed_books, remove_database
+
+import database
+from catalog_io import export_books
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def drain(fmt: str):
+    for _ in export_books(fmt):
+        pass
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100_000, 1_000_000]
+
+    for size in sizes:
+        path = use_temp_database(f'export_{size}')
+        seed_books(size, copies=1)
+        print(f'--- {size:,} books ---')
+        for fmt in ('csv', 'jsonl'):
+            elapsed, peak = measure(lambda: drain(fmt))
+            print(f'  stream {fmt:<5}     {elapsed:6.2f}s  peak {peak:8.1f} MiB')
+        elapsed, peak = measure(database.get_all_books)
+        print(f'  get_all_books()  {elapsed:6.2f}s  peak {peak:8.1f} MiB')
+        remove_database(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark: bulk CSV import throughput and peak memory.
+
+Writes a synthetic CSV feed (with a few invalid and duplicate rows) and
+imports it through catalog_io.import_books, reporting rows/s and the
+tracemalloc peak, which should stay flat as the file grows.
+
+    python benchmarks/bench_import.py [rows...]     (default: 50000 200000)
+"""
+
+import csv
+import os
+import sys
+import tempfile
+import tracemalloc
+
+from common import use_temp_database, remove_database
+
+from catalog_io import import_books
+
+
+def write_feed(path: str, rows: int):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['title', 'author', 'isbn', 'total_copies'])
+        for i in range(rows):
+            isbn = f'{i:013d}' if i % 1000 else f'{i - 1:013d}'  # every 1000th row is a duplicate
+            copies = '0' if i % 5000 == 1 else str(i % 5 + 1)     # and a few are invalid
+            writer.writerow([f'Vendor Title {i}', f'Vendor Author {i % 20000}', isbn, copies])
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [50_000, 200_000]
+
+    for rows in sizes:
+        path = use_temp_database(f'import_{rows}')
+        fd, feed = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        write_feed(feed, rows)
+
+        tracemalloc.start()
+        with open(feed, newline='', encoding='utf-8') as stream:
+            report = import_books(stream, 'csv')
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{rows:>9,} rows: imported {report['imported']:,}, rejected {report['rejected']:,} "
+              f"in {report['elapsed_seconds']:.2f}s ({report['rows_per_second']:,} rows/s), "
+              f"peak memory {peak / 1024 / 1024:.1f} MiB")
+        os.remove(feed)
+        remove_database(path)
+
+
+if __name__ == '__main__':
+    main()
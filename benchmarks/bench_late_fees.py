@@ -0,0 +1,50 @@
+"""
+Benchmark: batch late fee engine vs the scalar compute_late_fee.
+
+Checks that both produce identical results before reporting timings.
+
+    python benchmarks/bench_late_fees.py [loans]     (default: 1000000)
+"""
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import common  # noqa: F401 - puts the project root on sys.path
+
+import fee_engine
+from library_service import compute_late_fee
+
+
+def main():
+    loans = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = random.Random(42)
+    now = datetime.now()
+    today = now.date()
+    due_dates = [(now + timedelta(days=rng.randint(-60, 14), seconds=rng.randint(0, 86399))).isoformat()
+                 for _ in range(loans)]
+
+    start = time.perf_counter()
+    days, fees = fee_engine.compute_late_fees_batch(due_dates, today)
+    batch = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scalar = [compute_late_fee(datetime.fromisoformat(d), today) for d in due_dates]
+    loop = time.perf_counter() - start
+
+    mismatches = sum(1 for d, f, s in zip(days, fees, scalar)
+                     if d != s['days_overdue'] or f != s['fee_amount'])
+
+    engine = 'numpy' if fee_engine.np is not None else 'pure python'
+    print(f'{loans:,} loans')
+    print(f'  batch ({engine}): {batch:.3f}s')
+    print(f'  scalar loop:       {loop:.3f}s ({loop / batch:,.1f}x slower)')
+    if mismatches:
+        print(f'FAIL: {mismatches} results differ from compute_late_fee')
+        sys.exit(1)
+    print('OK: identical results')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Benchmark matrix: SQLite performance profiles on the catalog, borrow and return endpoints.
+
+Drives the real Flask app through its test client for each profile in
+database.PERFORMANCE_PROFILES.
+
+    python benchmarks/bench_profiles.py [requests_per_endpoint] [books]
+"""
+
+import sys
+
+from common import use_temp_database, seed_books, timed, remove_database
+
+import database
+from app import create_app
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    books = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    print(f'{"profile":>8} | {"catalog":>14} | {"borrow":>14} | {"return":>14}')
+    for profile in database.PERFORMANCE_PROFILES:
+        database.configure_profile(profile)
+        path = use_temp_database(f'profile_{profile}')
+        seed_books(books)
+        client = create_app({'DB_PROFILE': profile}).test_client()
+
+        def catalog():
+            for _ in range(requests):
+                client.get('/catalog')
+
+        def borrow():
+            for i in range(requests):
+                client.post('/borrow', data={'patron_id': f'{i:06d}', 'book_id': i % books + 1})
+
+        def return_():
+            for i in range(requests):
+                client.post('/return', data={'patron_id': f'{i:06d}', 'book_id': i % books + 1})
+
+        cells = []
+        for run in (catalog, borrow, return_):
+            elapsed = timed(run)
+            cells.append(f'{elapsed / requests * 1000:8.2f} ms/req')
+        print(f'{profile:>8} | ' + ' | '.join(cells))
+        remove_database(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmark: full-catalog scan vs the books_fts index for catalog search.
+
+    python benchmarks/bench_search.py [sizes...]     (default: 10000 100000 1000000)
+"""
+
+import random
+import sys
+
+from common import use_temp_database, timed, remove_database
+
+import database
+from library_service import search_books_in_catalog
+
+WORDS = ['river', 'shadow', 'garden', 'winter', 'empire', 'silent', 'harbor', 'crown',
+         'orchard', 'night', 'glass', 'mountain', 'letters', 'stone', 'summer', 'widow']
+QUERIES = [('harbor', 'title'), ('ow', 'title'), ('author 42', 'author'), ('silent night', 'title')]
+
+
+def scan_search(term: str, search_type: str):
+    """The original implementation: load every book and filter in Python."""
+    term = term.lower()
+    return [b for b in database.get_all_books() if term in str(b.get(search_type, '')).lower()]
+
+
+def seed(count: int):
+    rng = random.Random(count)
+    conn = database.get_db_connection()
+    conn.executemany('''
+        INSERT INTO books (title, author, isbn, total_copies, available_copies)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ((' '.join(rng.sample(WORDS, 3)).title(), f'Author {rng.randrange(count // 10 + 1)}',
+           f'{i:013d}', 1, 1) for i in range(count)))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    repeat = 5
+    database.search_cache.maxsize = 0  # time the index, not the result cache
+
+    for size in sizes:
+        path = use_temp_database(f'search_{size}')
+        seed(size)
+        print(f'--- {size:,} books ---')
+        for term, search_type in QUERIES:
+            scan = timed(scan_search, term, search_type, repeat=repeat) / repeat
+            fts = timed(search_books_in_catalog, term, search_type, repeat=repeat) / repeat
+            print(f'{search_type}:{term!r:>16}  scan {scan * 1000:9.2f} ms   fts {fts * 1000:8.2f} ms   '
+                  f'({scan / fts:,.0f}x)')
+        remove_database(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Benchmark: per-call latency of every library_service entry point at several
+dataset sizes, built with generate_dataset.py.
+
+    python benchmarks/bench_service.py --sizes 1000 10000 100000 --output results.json
+    python benchmarks/bench_service.py --compare results.json --threshold 0.25
+
+Results are JSON with p50/p95/p99 per function and size. With --compare the
+run exits non-zero when any function's chosen percentile is slower than the
+baseline by more than the threshold (a fraction, 0.25 = 25%).
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from common import remove_database
+from generate_dataset import ADJECTIVES, LAST_NAMES, NOUNS, generate_dataset
+
+import database
+from library_service import (
+    add_book_to_catalog, borrow_book_by_patron, return_book_by_patron,
+    calculate_late_fee_for_book, search_books_in_catalog, get_patron_status_report
+)
+
+PERCENTILES = (50, 95, 99)
+
+
+def summarize(samples: List[float]) -> Dict:
+    """Percentiles and mean of a list of durations in seconds, reported in ms."""
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    summary = {f'p{p}_ms': round(cuts[p - 1] * 1000, 4) for p in PERCENTILES}
+    summary['mean_ms'] = round(statistics.fmean(samples) * 1000, 4)
+    summary['calls'] = len(samples)
+    return summary
+
+
+def measure(func: Callable, calls: Sequence[tuple]) -> List[float]:
+    samples = []
+    for args in calls:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def sample_inputs(rng: random.Random, iterations: int) -> Dict[str, List[tuple]]:
+    """Pick arguments for each function from the current database."""
+    conn = database.get_db_connection()
+    available = [row[0] for row in conn.execute('SELECT id FROM books WHERE available_copies > 0')]
+    open_loans = [tuple(row) for row in conn.execute(
+        'SELECT patron_id, book_id FROM borrow_records WHERE return_date IS NULL LIMIT 10000')]
+    busy_patrons = [row[0] for row in conn.execute('''
+        SELECT patron_id FROM borrow_records GROUP BY patron_id ORDER BY COUNT(*) DESC LIMIT 1000
+    ''')]
+    known = {row[0] for row in conn.execute('SELECT DISTINCT patron_id FROM borrow_records')}
+    conn.close()
+
+    # Fresh patrons (no loans yet), each borrowing at most five books
+    fresh = (f'{p:06d}' for p in range(1_000_000) if f'{p:06d}' not in known)
+    loans = []
+    for i in range(iterations):
+        if i % 5 == 0:
+            patron = next(fresh)
+        loans.append((patron, rng.choice(available)))
+
+    terms = ([(rng.choice(ADJECTIVES).lower(), 'title') for _ in range(iterations // 2)] +
+             [(rng.choice(NOUNS).lower(), 'title') for _ in range(iterations // 4)] +
+             [(rng.choice(LAST_NAMES), 'author') for _ in range(iterations - iterations // 2 - iterations // 4)])
+    return {
+        'add_book_to_catalog': [(f'Benchmark Title {i}', 'Benchmark Author', f'999{i:010d}', 3)
+                                for i in range(iterations)],
+        'borrow_book_by_patron': loans,
+        'return_book_by_patron': loans,
+        'calculate_late_fee_for_book': [rng.choice(open_loans) for _ in range(iterations)] if open_loans else loans,
+        'search_books_in_catalog': terms,
+        'get_patron_status_report': [(rng.choice(busy_patrons),) for _ in range(iterations)],
+    }
+
+
+FUNCTIONS = [
+    ('add_book_to_catalog', add_book_to_catalog),
+    ('borrow_book_by_patron', borrow_book_by_patron),
+    ('return_book_by_patron', return_book_by_patron),
+    ('calculate_late_fee_for_book', calculate_late_fee_for_book),
+    ('search_books_in_catalog', search_books_in_catalog),
+    ('get_patron_status_report', get_patron_status_report),
+]
+
+
+def run(sizes: Sequence[int], iterations: int, seed: int) -> Dict:
+    results = {}
+    for size in sizes:
+        fd, path = tempfile.mkstemp(prefix=f'service_{size}_', suffix='.db')
+        os.close(fd)
+        print(f'--- {size:,} books: generating dataset ---', file=sys.stderr)
+        generate_dataset(path, books=size, patrons=max(100, size // 5), loans=size * 2, seed=seed)
+        previous = database.DATABASE
+        database.DATABASE = path
+        database.configure_pool()
+        try:
+            inputs = sample_inputs(random.Random(seed), iterations)
+            results[str(size)] = {}
+            for name, func in FUNCTIONS:
+                summary = summarize(measure(func, inputs[name]))
+                results[str(size)][name] = summary
+                print(f'{name:<30} p50 {summary["p50_ms"]:8.3f} ms  p95 {summary["p95_ms"]:8.3f} ms  '
+                      f'p99 {summary["p99_ms"]:8.3f} ms', file=sys.stderr)
+        finally:
+            remove_database(path)
+            database.DATABASE = previous
+            database.configure_pool()
+    return {
+        'meta': {'python': platform.python_version(), 'sqlite': database.sqlite3.sqlite_version,
+                 'iterations': iterations, 'seed': seed},
+        'results': results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, metric: str, threshold: float) -> List[str]:
+    """Return a line per (size, function) whose metric regressed beyond threshold."""
+    regressions = []
+    for size, functions in current['results'].items():
+        for name, summary in functions.items():
+            base = baseline.get('results', {}).get(size, {}).get(name)
+            if not base or not base.get(metric):
+                continue
+            ratio = summary[metric] / base[metric]
+            if ratio > 1 + threshold:
+                regressions.append(f'{name} @ {int(size):,} books: {metric} {base[metric]:.3f} -> '
+                                   f'{summary[metric]:.3f} ms ({ratio - 1:+.0%})')
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark library_service functions at several dataset sizes.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000], help='book counts')
+    parser.add_argument('--iterations', type=int, default=200, help='calls per function and size')
+    parser.add_argument('--seed', type=int, default=327)
+    parser.add_argument('--output', help='write JSON results here (default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE', help='baseline JSON to check for regressions')
+    parser.add_argument('--metric', choices=[f'p{p}_ms' for p in PERCENTILES], default='p95_ms')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, e.g. 0.25 = 25%%')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sizes = [int(size) for size in baseline['results']] if args.sizes == parser.get_default('sizes') else args.sizes
+        current = run(sizes, args.iterations, args.seed)
+    else:
+        current = run(args.sizes, args.iterations, args.seed)
+
+    text = json.dumps(current, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        regressions = compare(current, baseline, args.metric, args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        if regressions:
+            return 1
+        print(f'No regressions beyond {args.threshold:.0%} on {args.metric}.', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
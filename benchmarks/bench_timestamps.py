@@ -0,0 +1,104 @@
+"""
+Benchmark: ISO TEXT dates vs the integer *_ts columns (migration 8) for the
+overdue range query, the nightly fee batch and the open-loans report.
+
+    python benchmarks/bench_timestamps.py [loans...]     (default: 100000 1000000)
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+from common import timed, remove_database
+from generate_dataset import generate_dataset
+
+import database
+import fee_engine
+
+REPEAT = 5
+
+
+def overdue_text(now: datetime):
+    """Range query on the TEXT column: no usable index, full scan."""
+    conn = database.get_db_connection()
+    count = conn.execute('SELECT COUNT(*) FROM borrow_records WHERE return_date IS NULL AND due_date < ?',
+                         (now.isoformat(),)).fetchone()[0]
+    conn.close()
+    return count
+
+
+def overdue_epoch(now: datetime):
+    conn = database.get_db_connection()
+    count = conn.execute('SELECT COUNT(*) FROM borrow_records WHERE return_date IS NULL AND due_ts < ?',
+                         (database.to_epoch(now),)).fetchone()[0]
+    conn.close()
+    return count
+
+
+def fees_text(today):
+    conn = database.get_db_connection()
+    rows = conn.execute('SELECT due_date FROM borrow_records WHERE return_date IS NULL').fetchall()
+    conn.close()
+    return fee_engine.compute_late_fees_batch([row[0] for row in rows], today)
+
+
+def fees_epoch(today):
+    conn = database.get_db_connection()
+    rows = conn.execute('SELECT due_ts FROM borrow_records WHERE return_date IS NULL').fetchall()
+    conn.close()
+    return fee_engine.compute_late_fees_batch([row[0] for row in rows], today)
+
+
+def borrowed_books_text(patron_ids):
+    """The previous get_patron_borrowed_books: three ISO parses and a now() per row."""
+    conn = database.get_db_connection()
+    for patron_id in patron_ids:
+        records = conn.execute('''
+            SELECT br.*, b.title, b.author FROM borrow_records br JOIN books b ON br.book_id = b.id
+            WHERE br.patron_id = ? AND br.return_date IS NULL ORDER BY br.borrow_date
+        ''', (patron_id,)).fetchall()
+        [{'book_id': r['book_id'], 'title': r['title'], 'author': r['author'],
+          'borrow_date': datetime.fromisoformat(r['borrow_date']),
+          'due_date': datetime.fromisoformat(r['due_date']),
+          'is_overdue': datetime.now() > datetime.fromisoformat(r['due_date'])} for r in records]
+    conn.close()
+
+
+def borrowed_books_epoch(patron_ids):
+    for patron_id in patron_ids:
+        database.get_patron_borrowed_books(patron_id)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100_000, 1_000_000]
+    now = datetime.now().replace(microsecond=0)
+
+    for loans in sizes:
+        fd, path = tempfile.mkstemp(prefix=f'timestamps_{loans}_', suffix='.db')
+        os.close(fd)
+        generate_dataset(path, books=max(loans // 20, 100), patrons=max(loans // 100, 100), loans=loans,
+                         overdue_fraction=0.05, open_fraction=0.05, as_of=now)
+        database.DATABASE = path
+        database.configure_pool()
+        conn = database.get_db_connection()
+        patrons = [row[0] for row in conn.execute('''
+            SELECT patron_id FROM borrow_records WHERE return_date IS NULL
+            GROUP BY patron_id ORDER BY COUNT(*) DESC LIMIT 200
+        ''')]
+        conn.close()
+
+        print(f'--- {loans:,} loans ---')
+        for name, before, after, arg in [
+            ('overdue range query', overdue_text, overdue_epoch, now),
+            ('fee batch', fees_text, fees_epoch, now.date()),
+            ('open loans x200 patrons', borrowed_books_text, borrowed_books_epoch, patrons),
+        ]:
+            old = timed(before, arg, repeat=REPEAT) / REPEAT
+            new = timed(after, arg, repeat=REPEAT) / REPEAT
+            print(f'{name:<26} text {old * 1000:9.2f} ms   epoch {new * 1000:9.2f} ms   ({old / new:,.1f}x)')
+        remove_database(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Every benchmark runs against a throwaway database file so the shared
+library.db used by the tests is never touched.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+def use_temp_database(prefix: str = 'bench') -> str:
+    """Point database.py at a fresh temporary file and create the schema."""
+    fd, path = tempfile.mkstemp(prefix=f'{prefix}_', suffix='.db')
+    os.close(fd)
+    os.remove(path)
+    database.DATABASE = path
+    database.configure_pool()
+    database.init_database()
+    return path
+
+
+def seed_books(count: int, copies: int = 1000):
+    """Insert `count` books with plenty of copies in a single transaction."""
+    conn = database.get_db_connection()
+    conn.executemany('''
+        INSERT INTO books (title, author, isbn, total_copies, available_copies)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ((f'Book {i}', f'Author {i % 100}', f'{i:013d}', copies, copies) for i in range(1, count + 1)))
+    conn.commit()
+    conn.close()
+
+
+def timed(func, *args, repeat: int = 1):
+    """Run func(*args) `repeat` times and return the elapsed wall time in seconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return time.perf_counter() - start
+
+
+def remove_database(path: str):
+    database.configure_pool()
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
@@ -0,0 +1,222 @@
+"""
+Synthetic dataset generator for benchmarking.
+
+Fills a database with a deterministic (seeded) catalog and loan history:
+Zipf-distributed book and patron popularity, prolific authors, a
+configurable share of open and overdue loans, and copy counts consistent
+with the open loans. Indexes and triggers are dropped during the bulk load
+and rebuilt afterwards, so tens of millions of rows load in minutes.
+
+    python benchmarks/generate_dataset.py --database bench.db \\
+        --books 1000000 --patrons 200000 --loans 20000000
+
+Dates are generated relative to --as-of (default: now), so the same seed and
+--as-of always produce the same database.
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from common import database
+from loan_counters import OPEN_LOANS_BY_BOOK, OPEN_LOANS_BY_PATRON
+
+MAX_OPEN_LOANS_PER_PATRON = 5
+LOAN_DAYS = 14
+HISTORY_DAYS = 365
+CHUNK_SIZE = 50_000
+
+ADJECTIVES = ['Silent', 'Hidden', 'Broken', 'Golden', 'Last', 'Distant', 'Crimson', 'Quiet', 'Wild',
+              'Forgotten', 'Burning', 'Winter', 'Hollow', 'Bright', 'Secret', 'Lost', 'Iron', 'Velvet']
+NOUNS = ['River', 'Garden', 'Empire', 'Harbor', 'Crown', 'Orchard', 'Night', 'Glass', 'Mountain',
+         'Letters', 'Stone', 'Summer', 'Widow', 'Kingdom', 'Shadow', 'Lighthouse', 'Archive', 'Voyage']
+FIRST_NAMES = ['Ada', 'Ben', 'Chloe', 'Dev', 'Elena', 'Farid', 'Grace', 'Hiro', 'Iris', 'Jonah',
+               'Kira', 'Liam', 'Maya', 'Noor', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sami', 'Tess']
+LAST_NAMES = ['Abbott', 'Brennan', 'Castillo', 'Dumont', 'Eriksen', 'Fischer', 'Garcia', 'Haddad',
+              'Ito', 'Jensen', 'Kowalski', 'Laurent', 'Moreau', 'Nakamura', 'Okafor', 'Petrov']
+
+
+def zipf_cum_weights(n: int, s: float) -> List[float]:
+    """Cumulative Zipf weights for ranks 1..n, for random.choices(cum_weights=...)."""
+    return list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def _drop_load_objects(conn: sqlite3.Connection) -> List[str]:
+    """Drop indexes and triggers on the loaded tables, returning the SQL to recreate them."""
+    rows = conn.execute('''
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND tbl_name IN ('books', 'borrow_records') AND sql IS NOT NULL
+    ''').fetchall()
+    for kind, name, _ in rows:
+        conn.execute(f'DROP {kind.upper()} {name}')
+    return [sql for _, _, sql in rows]
+
+
+def generate_dataset(path: str, books: int, patrons: int, loans: int, seed: int = 327,
+                     overdue_fraction: float = 0.02, open_fraction: float = 0.03,
+                     author_ratio: float = 0.1, as_of: Optional[datetime] = None,
+                     progress=None) -> Dict:
+    """
+    Create (or replace) a database at `path` filled with synthetic data.
+
+    Args:
+        books, patrons, loans: row counts (patrons must fit 6-digit card IDs)
+        seed: random seed; the same seed and as_of give the same data
+        overdue_fraction: share of loans that are open and past due
+        open_fraction: share of loans that are open and still on time
+        author_ratio: authors per book; authors are Zipf-weighted, so a few write many titles
+        as_of: reference "now" for all dates
+
+    Returns:
+        dict: row counts and elapsed seconds per phase
+    """
+    if not 0 < patrons <= 1_000_000:
+        raise ValueError('patrons must be between 1 and 1,000,000 (6-digit card IDs).')
+    as_of = as_of or datetime.now().replace(microsecond=0)
+    rng = random.Random(seed)
+    report = {'books': books, 'patrons': patrons, 'loans': loans}
+    log = progress or (lambda message: None)
+
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    previous = database.DATABASE
+    database.DATABASE = path
+    database.configure_pool()
+    try:
+        database.init_database()
+    finally:
+        database.DATABASE = previous
+        database.configure_pool()
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    recreate = _drop_load_objects(conn)
+
+    # Loans first: their open counts decide each book's copies
+    start = time.perf_counter()
+    book_weights = zipf_cum_weights(books, 1.07)
+    patron_weights = zipf_cum_weights(patrons, 0.8)
+    patron_ids = [f'{p:06d}' for p in rng.sample(range(1_000_000), patrons)]
+    open_per_book = array('i', bytes(4 * (books + 1)))
+    open_per_patron = array('i', bytes(4 * patrons))
+    open_loans = overdue_loans = 0
+
+    conn.execute('BEGIN')
+    remaining = loans
+    while remaining > 0:
+        n = min(CHUNK_SIZE, remaining)
+        remaining -= n
+        book_ids = rng.choices(range(1, books + 1), cum_weights=book_weights, k=n)
+        patron_idx = rng.choices(range(patrons), cum_weights=patron_weights, k=n)
+        rows = []
+        for book_id, p in zip(book_ids, patron_idx):
+            u = rng.random()
+            is_open = u < overdue_fraction + open_fraction and open_per_patron[p] < MAX_OPEN_LOANS_PER_PATRON
+            if is_open and u < overdue_fraction:
+                borrowed = as_of - timedelta(days=rng.randint(LOAN_DAYS + 1, HISTORY_DAYS), seconds=rng.randint(0, 86399))
+            elif is_open:
+                borrowed = as_of - timedelta(days=rng.randint(0, LOAN_DAYS - 1), seconds=rng.randint(0, 86399))
+            else:
+                borrowed = as_of - timedelta(days=rng.randint(1, HISTORY_DAYS), seconds=rng.randint(0, 86399))
+            due = borrowed + timedelta(days=LOAN_DAYS)
+            if is_open:
+                returned = None
+                open_per_patron[p] += 1
+                open_per_book[book_id] += 1
+                open_loans += 1
+                overdue_loans += due < as_of
+            else:
+                returned = min(borrowed + timedelta(days=rng.randint(1, 21), seconds=rng.randint(0, 86399)), as_of)
+                returned = returned.isoformat()
+            rows.append((patron_ids[p], book_id, borrowed.isoformat(), due.isoformat(), returned))
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        log(f'loans: {loans - remaining:,}/{loans:,}')
+    conn.execute('COMMIT')
+    report['open_loans'] = open_loans
+    report['overdue_loans'] = overdue_loans
+    report['loans_seconds'] = round(time.perf_counter() - start, 2)
+
+    start = time.perf_counter()
+    author_count = max(1, int(books * author_ratio))
+    authors = [f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {a}' for a in range(author_count)]
+    author_weights = zipf_cum_weights(author_count, 1.0)
+    conn.execute('BEGIN')
+    for first in range(1, books + 1, CHUNK_SIZE):
+        ids = range(first, min(first + CHUNK_SIZE, books + 1))
+        book_authors = rng.choices(authors, cum_weights=author_weights, k=len(ids))
+        rows = []
+        for book_id, author in zip(ids, book_authors):
+            total = max(rng.randint(1, 5), open_per_book[book_id])
+            title = f'The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}'
+            if rng.random() < 0.5:
+                title += f' {rng.randint(1, 999)}'
+            rows.append((book_id, title, author, f'978{book_id:010d}', total, total - open_per_book[book_id]))
+        conn.executemany('''
+            INSERT INTO books (id, title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        log(f'books: {ids[-1]:,}/{books:,}')
+    conn.execute('COMMIT')
+    report['books_seconds'] = round(time.perf_counter() - start, 2)
+
+    start = time.perf_counter()
+    log('rebuilding indexes and triggers')
+    conn.execute('BEGIN')
+    for sql in recreate:
+        conn.execute(sql)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'books_fts'").fetchone():
+        conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+    # The counter triggers were dropped for the load, so fill the counters in one pass
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'patron_loans'").fetchone():
+        conn.execute(f'INSERT INTO patron_loans (patron_id, active_loans) {OPEN_LOANS_BY_PATRON}')
+        conn.execute(f'INSERT INTO book_loans (book_id, active_loans) {OPEN_LOANS_BY_BOOK}')
+    conn.execute('COMMIT')
+    conn.execute('ANALYZE')
+    conn.close()
+    report['index_seconds'] = round(time.perf_counter() - start, 2)
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Generate a synthetic library database for benchmarks.')
+    parser.add_argument('--database', default='benchmark_library.db', help='output file (replaced if it exists)')
+    parser.add_argument('--books', type=int, default=100_000)
+    parser.add_argument('--patrons', type=int, default=20_000)
+    parser.add_argument('--loans', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=327)
+    parser.add_argument('--overdue-fraction', type=float, default=0.02)
+    parser.add_argument('--open-fraction', type=float, default=0.03)
+    parser.add_argument('--as-of', type=datetime.fromisoformat, help='reference date (default: now)')
+    args = parser.parse_args(argv)
+
+    if os.path.abspath(args.database) == os.path.abspath('library.db'):
+        print('Refusing to overwrite library.db; pass a different --database.', file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    report = generate_dataset(args.database, args.books, args.patrons, args.loans, args.seed,
+                              args.overdue_fraction, args.open_fraction, as_of=args.as_of,
+                              progress=lambda message: print(f'\r{message:<60}', end='', file=sys.stderr))
+    print(file=sys.stderr)
+    print(f"{args.database}: {report['books']:,} books, {report['loans']:,} loans "
+          f"({report['open_loans']:,} open, {report['overdue_loans']:,} overdue) "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
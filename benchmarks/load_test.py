@@ -0,0 +1,222 @@
+"""
+Load test: drive the real WSGI app from create_app() with rising concurrency
+and a weighted request mix.
+
+    python benchmarks/load_test.py --mode server --concurrency 1 4 16 --duration 10
+    python benchmarks/load_test.py --mode client --processes 4 --mix catalog=70,search=20,borrow=10
+
+--mode server serves the app on a local werkzeug server and sends real HTTP;
+--mode client uses Flask's test client (no sockets). Each concurrency level
+runs that many threads in each of --processes processes. The report shows
+throughput, latency percentiles, 5xx/transport errors and SQLITE_BUSY counts
+(library_db_busy_errors_total) per level. The app runs against a temporary
+database, never library.db.
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import urlencode
+
+from common import use_temp_database, seed_books, remove_database
+from bench_service import summarize
+
+import database
+import metrics
+
+DEFAULT_MIX = 'catalog=70,search=20,borrow=10'
+SEARCH_TERMS = ['book 1', 'book 42', 'author 7', 'book 99']
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('catalog', 'search', 'borrow'):
+            raise ValueError(f'Unknown request kind {name!r}; use catalog, search or borrow.')
+        mix[name] = int(weight)
+    return mix
+
+
+class ClientTransport:
+    """Send requests through a Flask test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, form: Optional[Dict] = None) -> int:
+        return self.client.open(path, method=method, data=form).status_code
+
+
+class HTTPTransport:
+    """Send requests over HTTP to a running server."""
+
+    def __init__(self, port: int):
+        self.port = port
+
+    def request(self, method: str, path: str, form: Optional[Dict] = None) -> int:
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            body = urlencode(form) if form else None
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'} if form else {}
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+
+def worker(transport, mix: Dict[str, int], deadline: float, patron_id: str, books: int,
+           seed: int, results: List):
+    """Issue requests until the deadline, appending (kind, seconds, ok) tuples."""
+    rng = random.Random(seed)
+    kinds, weights = zip(*mix.items())
+    while time.perf_counter() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'catalog':
+            calls = [('catalog', 'GET', '/catalog', None)]
+        elif kind == 'search':
+            calls = [('search', 'GET', '/api/search?' + urlencode({'q': rng.choice(SEARCH_TERMS)}), None)]
+        else:
+            # Borrow then return the same copy so the patron never hits the loan limit
+            form = {'patron_id': patron_id, 'book_id': rng.randint(1, books)}
+            calls = [('borrow', 'POST', '/borrow', form), ('return', 'POST', '/return', form)]
+        for name, method, path, form in calls:
+            start = time.perf_counter()
+            try:
+                ok = transport.request(method, path, form) < 500
+            except Exception:
+                ok = False
+            results.append((name, time.perf_counter() - start, ok))
+
+
+def run_threads(make_transport, threads: int, mix: Dict[str, int], duration: float,
+                books: int, offset: int) -> List:
+    results = []
+    deadline = time.perf_counter() + duration
+    pool = [threading.Thread(target=worker, args=(make_transport(), mix, deadline,
+                                                  f'{offset + i:06d}', books, offset + i, results))
+            for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return results
+
+
+def _client_process(args):
+    """Entry point for one load-generating process in client mode."""
+    path, threads, mix, duration, books, offset = args
+    from app import create_app
+    database.DATABASE = path
+    database.configure_pool()
+    app = create_app()
+    busy_before = metrics.DB_BUSY_ERRORS.value()
+    results = run_threads(lambda: ClientTransport(app), threads, mix, duration, books, offset)
+    return results, metrics.DB_BUSY_ERRORS.value() - busy_before
+
+
+def _server_process(args):
+    """Entry point for one load-generating process in server mode."""
+    port, threads, mix, duration, books, offset = args
+    return run_threads(lambda: HTTPTransport(port), threads, mix, duration, books, offset), 0
+
+
+def run_level(mode: str, target, processes: int, threads: int, mix: Dict[str, int],
+              duration: float, books: int):
+    """Run one concurrency level and return (results, busy_count, wall_seconds)."""
+    busy_before = metrics.DB_BUSY_ERRORS.value()
+    jobs = [(target, threads, mix, duration, books, 100_000 + p * 1000) for p in range(processes)]
+    entry = _client_process if mode == 'client' else _server_process
+    start = time.perf_counter()
+    if processes == 1 and mode == 'client':
+        app = target
+        results = run_threads(lambda: ClientTransport(app), threads, mix, duration, books, 100_000)
+        outcomes = [(results, 0)]
+    elif processes == 1:
+        outcomes = [entry(jobs[0])]
+    else:
+        if mode == 'client':
+            jobs = [(database.DATABASE,) + job[1:] for job in jobs]
+        with multiprocessing.Pool(processes) as pool:
+            outcomes = pool.map(entry, jobs)
+    wall = time.perf_counter() - start
+    results = [row for rows, _ in outcomes for row in rows]
+    busy = sum(count for _, count in outcomes) + metrics.DB_BUSY_ERRORS.value() - busy_before
+    return results, int(busy), wall
+
+
+def report_level(concurrency: int, results: List, busy: int, wall: float) -> Dict:
+    latencies = [seconds for _, seconds, _ in results]
+    summary = summarize(latencies) if len(latencies) > 1 else {}
+    by_kind = {}
+    for kind, _, _ in results:
+        by_kind[kind] = by_kind.get(kind, 0) + 1
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'throughput_rps': round(len(results) / wall, 1),
+        'errors': sum(1 for _, _, ok in results if not ok),
+        'sqlite_busy': busy,
+        'by_kind': by_kind,
+        **summary,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Concurrent load test for the library Flask app.')
+    parser.add_argument('--mode', choices=['server', 'client'], default='server')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help='threads per process at each level')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per level')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument('--books', type=int, default=10_000)
+    parser.add_argument('--output', help='also write JSON results here')
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    path = use_temp_database('load')
+    seed_books(args.books)
+    app = create_app()
+    server = None
+    target = app
+    if args.mode == 'server':
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        target = server.server_port
+
+    levels = []
+    try:
+        print(f'{"conc":>5} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7} {"busy":>6}')
+        for threads in args.concurrency:
+            results, busy, wall = run_level(args.mode, target, args.processes, threads, args.mix,
+                                            args.duration, args.books)
+            level = report_level(threads * args.processes, results, busy, wall)
+            levels.append(level)
+            print(f'{level["concurrency"]:>5} {level["throughput_rps"]:>9.1f} {level.get("p50_ms", 0):>8.2f} '
+                  f'{level.get("p95_ms", 0):>8.2f} {level.get("p99_ms", 0):>8.2f} {level["errors"]:>7} '
+                  f'{level["sqlite_busy"]:>6}')
+    finally:
+        if server is not None:
+            server.shutdown()
+        remove_database(path)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'mode': args.mode, 'processes': args.processes, 'mix': args.mix, 'levels': levels}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+Bulk Returns Module - Drop-box return processing
+Reads (patron_id, book_id, returned_at) records from CSV or JSON Lines,
+closes the matching open loans in batched transactions and reports the late
+fee owed for each record
+
+Command line usage:
+
+    python bulk_returns.py dropbox.csv [--format csv|jsonl] [--batch-size N]
+
+CSV files need a header row with patron_id and book_id; returned_at is an
+optional ISO timestamp (default: now).
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, TextIO, Tuple
+
+from catalog_io import FORMATS, READ_ERRORS, format_for_filename, iter_book_records, read_error_message
+from database import SECONDS_PER_DAY, epoch_day, return_loans_bulk
+from library_service import late_fee_for_days
+
+RETURN_BATCH_SIZE = 500
+
+
+def parse_return_record(record: Optional[Dict], default_returned_at: datetime
+                        ) -> Tuple[Optional[Tuple[str, int, datetime]], Optional[str]]:
+    """
+    Turn a raw record into a (patron_id, book_id, returned_at) tuple.
+
+    Like every other borrow_records timestamp, returned_at is naive local
+    time: a timestamp with a UTC offset is converted to it. Return times
+    after default_returned_at (now) are rejected.
+
+    Returns:
+        tuple: (row or None, error message or None)
+    """
+    if record is None:
+        return None, "Malformed record."
+
+    patron_id = str(record.get('patron_id') or '').strip()
+    if not patron_id.isdigit() or len(patron_id) != 6:
+        return None, "Invalid patron ID. Must be exactly 6 digits."
+    try:
+        book_id = int(str(record.get('book_id', '')).strip())
+    except ValueError:
+        return None, "Invalid book ID. Must be an integer."
+
+    returned_at = str(record.get('returned_at') or '').strip()
+    if not returned_at:
+        return (patron_id, book_id, default_returned_at), None
+    try:
+        parsed = datetime.fromisoformat(returned_at)
+    except ValueError:
+        return None, "Invalid returned_at. Use an ISO date or timestamp."
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    if parsed > default_returned_at:
+        return None, "Invalid returned_at. It cannot be in the future."
+    return (patron_id, book_id, parsed), None
+
+
+def process_returns(stream: TextIO, fmt: str, batch_size: int = RETURN_BATCH_SIZE,
+                    now: Optional[datetime] = None) -> Dict:
+    """
+    Process a stream of return records, batch_size records per transaction.
+
+    If the file becomes unreadable part-way through, the batches before that
+    point stay processed and the report carries an 'error'.
+
+    Returns:
+        dict: returned / not_borrowed / rejected counts, total late fees, one
+        result per record (line, patron_id, book_id, status, days_overdue,
+        late_fee, message) and elapsed time
+    """
+    now = now or datetime.now()
+    report = {'returned': 0, 'not_borrowed': 0, 'rejected': 0, 'total_late_fees': 0.00, 'results': []}
+    start = time.perf_counter()
+
+    def flush(batch: List[Tuple[int, Tuple[str, int, datetime]]]):
+        closed = return_loans_bulk([row for _, row in batch])
+        for (line_number, (patron_id, book_id, returned_at)), loan in zip(batch, closed or [None] * len(batch)):
+            result = {'line': line_number, 'patron_id': patron_id, 'book_id': book_id,
+                      'returned_at': returned_at.isoformat()}
+            if closed is None:
+                report['rejected'] += 1
+                result.update(status='error', message="Database error occurred while processing the return.")
+            elif loan is None:
+                report['not_borrowed'] += 1
+                result.update(status='not_borrowed', message="This patron has not borrowed this book.")
+            elif loan['loan_id'] is None:
+                report['rejected'] += 1
+                result.update(status='rejected', message="Invalid returned_at. It is before the book was borrowed.")
+            else:
+                fee_info = late_fee_for_days(epoch_day(returned_at.date()) - loan['due_ts'] // SECONDS_PER_DAY)
+                report['returned'] += 1
+                report['total_late_fees'] += fee_info['fee_amount']
+                result.update(status='returned', days_overdue=fee_info['days_overdue'],
+                              late_fee=fee_info['fee_amount'], message="Book returned.")
+            report['results'].append(result)
+
+    batch: List[Tuple[int, Tuple[str, int, datetime]]] = []
+    line_number = 0
+    try:
+        for line_number, record in iter_book_records(stream, fmt):
+            row, error = parse_return_record(record, now)
+            if error:
+                report['rejected'] += 1
+                report['results'].append({'line': line_number, 'status': 'rejected', 'message': error})
+                continue
+            batch.append((line_number, row))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+    except READ_ERRORS as e:
+        report['error'] = read_error_message(e, line_number)
+    if batch:
+        flush(batch)
+
+    report['results'].sort(key=lambda result: result['line'])
+    report['total_late_fees'] = round(report['total_late_fees'], 2)
+    report['elapsed_seconds'] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Process a drop-box file of book returns.')
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--batch-size', type=int, default=RETURN_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or format_for_filename(args.path)
+    if fmt is None:
+        parser.error('cannot tell the file format from its name; pass --format')
+
+    from database import init_database
+    init_database()
+
+    with open(args.path, newline='', encoding='utf-8') as stream:
+        report = process_returns(stream, fmt, args.batch_size)
+
+    for result in report['results']:
+        fee = f" late fee ${result['late_fee']:.2f}" if result.get('late_fee') else ''
+        who = f"{result['patron_id']} / book {result['book_id']}: " if 'patron_id' in result else ''
+        print(f"  line {result['line']}: {who}{result['message']}{fee}")
+    print(f"Returned {report['returned']}, not borrowed {report['not_borrowed']}, rejected {report['rejected']}; "
+          f"${report['total_late_fees']:.2f} in late fees ({report['elapsed_seconds']}s)")
+    if 'error' in report:
+        print(report['error'], file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Catalog I/O Module - Bulk catalog import and export
+Streams CSV or JSON Lines book files into the catalog in batched transactions,
+and streams the catalog back out without loading it into memory
+
+Command line usage:
+
+    python catalog_io.py import books.csv [--format csv|jsonl] [--batch-size N]
+    python catalog_io.py export [--format csv|jsonl] [--output books.csv]
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+from database import find_existing_isbns, insert_books_bulk, iter_books
+from library_service import validate_book_fields
+
+IMPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_REJECTIONS = 100
+FORMATS = ('csv', 'jsonl')
+FORMAT_ALIASES = {'ndjson': 'jsonl'}
+EXPORT_COLUMNS = ('id', 'title', 'author', 'isbn', 'total_copies', 'available_copies')
+
+# Errors that make the rest of an uploaded file unreadable
+READ_ERRORS = (UnicodeDecodeError, csv.Error)
+
+
+def normalize_format(fmt: Optional[str]) -> Optional[str]:
+    """Map a user-supplied format name to one of FORMATS (or None if unknown)."""
+    fmt = (fmt or '').lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    return fmt if fmt in FORMATS else None
+
+
+def format_for_filename(filename: Optional[str]) -> Optional[str]:
+    """Guess the import format from a file extension."""
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def iter_book_records(stream: TextIO, fmt: str) -> Iterator[Tuple[int, Optional[Dict]]]:
+    """
+    Yield (line number, record) pairs one at a time.
+
+    CSV files need a header row with title, author, isbn and total_copies.
+    JSON Lines files hold one object per line; a line that is not a JSON
+    object yields None as its record.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_number, record if isinstance(record, dict) else None
+    else:
+        raise ValueError(f"Unsupported import format '{fmt}'. Use one of: {', '.join(FORMATS)}.")
+
+
+def read_error_message(error: Exception, last_line: int) -> str:
+    """Describe why reading stopped, for the import or returns report."""
+    reason = "the file is not valid UTF-8 text" if isinstance(error, UnicodeDecodeError) else f"malformed CSV ({error})"
+    return f"Stopped reading after line {last_line}: {reason}."
+
+
+def parse_book_record(record: Optional[Dict]) -> Tuple[Optional[Tuple[str, str, str, int, int]], Optional[str]]:
+    """
+    Turn a raw record into a books row using the R1 validation rules.
+
+    Returns:
+        tuple: (row or None, error message or None)
+    """
+    if record is None:
+        return None, "Malformed record."
+
+    title = str(record.get('title') or '').strip()
+    author = str(record.get('author') or '').strip()
+    isbn = str(record.get('isbn') or '').strip()
+    try:
+        total_copies = int(str(record.get('total_copies', '')).strip())
+    except ValueError:
+        return None, "Total copies must be a positive integer."
+
+    error = validate_book_fields(title, author, isbn, total_copies)
+    if error:
+        return None, error
+    return (title, author, isbn, total_copies, total_copies), None
+
+
+def import_books(stream: TextIO, fmt: str, batch_size: int = IMPORT_BATCH_SIZE) -> Dict:
+    """
+    Import books from a CSV or JSON Lines stream.
+
+    Records are validated as they are read and inserted `batch_size` at a
+    time: each batch is de-duplicated with one ISBN lookup and written with
+    executemany in a single transaction, so memory use does not grow with
+    the size of the file.
+
+    Batches already written stay imported if the file turns out to be
+    unreadable part-way through (not UTF-8, broken CSV quoting); the report
+    then carries an 'error' saying where reading stopped.
+
+    Returns:
+        dict: imported and rejected counts, the first rejections, elapsed
+        time and throughput
+    """
+    report = {'imported': 0, 'rejected': 0, 'rejections': []}
+    start = time.perf_counter()
+
+    def reject(line_number: int, isbn: str, reason: str):
+        report['rejected'] += 1
+        if len(report['rejections']) < MAX_REPORTED_REJECTIONS:
+            report['rejections'].append({'line': line_number, 'isbn': isbn, 'reason': reason})
+
+    def flush(batch: List[Tuple[int, Tuple]]):
+        existing = find_existing_isbns([row[2] for _, row in batch])
+        rows = []
+        for line_number, row in batch:
+            if row[2] in existing:
+                reject(line_number, row[2], "A book with this ISBN already exists.")
+            else:
+                rows.append(row)
+        if rows and insert_books_bulk(rows):
+            report['imported'] += len(rows)
+        else:
+            for line_number, row in batch:
+                if row[2] not in existing:
+                    reject(line_number, row[2], "Database error occurred while adding the book.")
+
+    batch: List[Tuple[int, Tuple]] = []
+    batch_isbns = set()
+    line_number = 0
+    try:
+        for line_number, record in iter_book_records(stream, fmt):
+            row, error = parse_book_record(record)
+            if error:
+                reject(line_number, str((record or {}).get('isbn', '')), error)
+                continue
+            if row[2] in batch_isbns:
+                reject(line_number, row[2], "A book with this ISBN already exists.")
+                continue
+            batch.append((line_number, row))
+            batch_isbns.add(row[2])
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch, batch_isbns = [], set()
+    except READ_ERRORS as e:
+        report['error'] = read_error_message(e, line_number)
+    if batch:
+        flush(batch)
+
+    elapsed = time.perf_counter() - start
+    report['elapsed_seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round((report['imported'] + report['rejected']) / elapsed) if elapsed else None
+    return report
+
+
+def export_books(fmt: str, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yield the whole catalog as CSV or JSON Lines text, one chunk of rows at a time.
+
+    Memory use depends on chunk_size, not on the size of the catalog.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format '{fmt}'. Use one of: {', '.join(FORMATS)}.")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(EXPORT_COLUMNS)
+
+    pending = 0
+    for book in iter_books(chunk_size):
+        if writer:
+            writer.writerow([book[column] for column in EXPORT_COLUMNS])
+        else:
+            buffer.write(json.dumps({column: book[column] for column in EXPORT_COLUMNS}) + '\n')
+        pending += 1
+        if pending >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Bulk catalog import and export.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help='import books from a CSV or JSON Lines file')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=FORMATS)
+    import_parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    export_parser = commands.add_parser('export', help='write the catalog as CSV or JSON Lines')
+    export_parser.add_argument('--format', choices=FORMATS + tuple(FORMAT_ALIASES), default='csv')
+    export_parser.add_argument('--output', help='file to write (default: standard output)')
+    args = parser.parse_args(argv)
+
+    from database import init_database
+    init_database()
+
+    if args.command == 'export':
+        fmt = normalize_format(args.format)
+        output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+        try:
+            for chunk in export_books(fmt):
+                output.write(chunk)
+        finally:
+            if args.output:
+                output.close()
+        return 0
+
+    fmt = args.format or format_for_filename(args.path)
+    if fmt is None:
+        parser.error('cannot tell the file format from its name; pass --format')
+    with open(args.path, newline='', encoding='utf-8') as stream:
+        report = import_books(stream, fmt, args.batch_size)
+
+    print(f"Imported {report['imported']} books, rejected {report['rejected']} "
+          f"in {report['elapsed_seconds']}s ({report['rows_per_second']} rows/s)")
+    for rejection in report['rejections']:
+        print(f"  line {rejection['line']}: {rejection['isbn']}: {rejection['reason']}")
+    if 'error' in report:
+        print(report['error'], file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,120 +3,666 @@ Database module for Library Management System
 Handles all database operations and connections
 """
 
+import os
+import queue
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from cache import LRUCache
+from metrics import DB_BUSY_ERRORS, REGISTRY, timed_db_helper
+from migrations import run_migrations
+from query_stats import timed_execute
 
 # Database configuration
 DATABASE = 'library.db'
 
-def get_db_connection():
-    """Get a database connection."""
-    conn = sqlite3.connect(DATABASE)
+# Outcomes reported by borrow_book_atomic
+BORROW_OK = 'ok'
+BORROW_BOOK_NOT_FOUND = 'book_not_found'
+BORROW_NOT_AVAILABLE = 'not_available'
+BORROW_LIMIT_REACHED = 'limit_reached'
+BORROW_DB_ERROR = 'db_error'
+
+# Connection pool configuration (a size of 0 disables pooling and connects per call)
+POOL_SIZE = int(os.environ.get('LIBRARY_DB_POOL_SIZE', '5'))
+POOL_TIMEOUT = float(os.environ.get('LIBRARY_DB_POOL_TIMEOUT', '5'))
+POOL_HEALTH_CHECK_INTERVAL = 30.0
+
+# SQLite performance profiles, selected with LIBRARY_DB_PROFILE or the DB_PROFILE app config.
+# journal_mode is stored in the database file and is set by init_database; the
+# other pragmas are applied to every new connection.
+PERFORMANCE_PROFILES = {
+    'default': {},
+    'safe': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+    },
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # negative values are KiB
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+DB_PROFILE = os.environ.get('LIBRARY_DB_PROFILE', 'default')
+
+# Read-through cache for get_book_by_id / get_book_by_isbn (a size of 0 disables it)
+BOOK_CACHE_SIZE = int(os.environ.get('LIBRARY_BOOK_CACHE_SIZE', '1024'))
+BOOK_CACHE_TTL = float(os.environ.get('LIBRARY_BOOK_CACHE_TTL', '60'))
+book_cache = LRUCache(BOOK_CACHE_SIZE, BOOK_CACHE_TTL)
+
+# Result cache for search_books / search_books_page, bounded by entries and bytes.
+# Keys include the catalog version, so any catalog change makes older results unreachable.
+SEARCH_CACHE_SIZE = int(os.environ.get('LIBRARY_SEARCH_CACHE_SIZE', '1024'))
+SEARCH_CACHE_TTL = float(os.environ.get('LIBRARY_SEARCH_CACHE_TTL', '30'))
+SEARCH_CACHE_BYTES = int(os.environ.get('LIBRARY_SEARCH_CACHE_BYTES', str(16 * 1024 * 1024)))
+search_cache = LRUCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, maxbytes=SEARCH_CACHE_BYTES,
+                        sizeof=lambda rows: len(repr(rows)))  # approximate, but proportional to the rows
+
+_version_lock = threading.Lock()
+_version_conn: Optional[sqlite3.Connection] = None
+_version_path: Optional[str] = None
+_version_seen: Tuple[Optional[int], Optional[int]] = (None, None)  # (data_version, catalog version)
+
+def get_catalog_version() -> Optional[int]:
+    """
+    Return the catalog version stored in the database, or None if it cannot be read.
+
+    Triggers bump the catalog_version row in the same transaction as any change
+    to books, whichever process makes it. A private connection polls
+    PRAGMA data_version, which only changes after another connection commits,
+    and re-reads the row only then.
+    """
+    global _version_conn, _version_path, _version_seen
+    with _version_lock:
+        try:
+            if _version_conn is None or _version_path != DATABASE:
+                if _version_conn is not None:
+                    _version_conn.close()
+                _version_conn = sqlite3.connect(DATABASE, check_same_thread=False)
+                _version_path = DATABASE
+                _version_seen = (None, None)
+            data_version = _version_conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version != _version_seen[0]:
+                row = _version_conn.execute('SELECT version FROM catalog_version WHERE id = 1').fetchone()
+                _version_seen = (data_version, row[0] if row else None)
+            return _version_seen[1]
+        except sqlite3.Error:
+            _version_seen = (None, None)
+            return None
+
+# Called after books are added: listener(rows) with {id, title, author} for
+# each new book, or listener(None) after a bulk insert that did not read ids back
+book_insert_listeners: List[Callable[[Optional[List[Dict]]], None]] = []
+
+def _notify_book_insert(books: Optional[List[Dict]]):
+    for listener in book_insert_listeners:
+        listener(books)
+
+def _cache_metrics(name: str, cache: LRUCache):
+    def collect() -> List[str]:
+        stats = cache.stats()
+        lines = []
+        for key in ('hits', 'misses', 'evictions', 'expirations'):
+            lines.append(f'# TYPE library_{name}_cache_{key}_total counter')
+            lines.append(f'library_{name}_cache_{key}_total {stats[key]}')
+        lines.append(f'# TYPE library_{name}_cache_entries gauge')
+        lines.append(f"library_{name}_cache_entries {stats['size']}")
+        if stats['maxbytes'] is not None:
+            lines.append(f'# TYPE library_{name}_cache_bytes gauge')
+            lines.append(f"library_{name}_cache_bytes {stats['bytes']}")
+        lines.append(f'# TYPE library_{name}_cache_hit_ratio gauge')
+        lines.append(f"library_{name}_cache_hit_ratio {stats['hit_rate'] or 0}")
+        return lines
+    return collect
+
+REGISTRY.add_collector(_cache_metrics('book', book_cache))
+REGISTRY.add_collector(_cache_metrics('search', search_cache))
+
+# borrow_records stores naive local ISO timestamps; the *_ts columns hold the
+# same wall-clock time as seconds since 1970-01-01 (no timezone conversion)
+EPOCH = datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+SECONDS_PER_DAY = 86400
+
+def to_epoch(value: datetime) -> int:
+    """Convert a naive datetime to the integer form used by the *_ts columns."""
+    return int((value - EPOCH).total_seconds())
+
+def epoch_day(value: date) -> int:
+    """Day number of a date on the same scale as `*_ts // SECONDS_PER_DAY`."""
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def _count_busy(error: sqlite3.OperationalError):
+    """Count lock-contention failures so load tests can see them in /metrics."""
+    message = str(error)
+    if 'locked' in message or 'busy' in message:
+        DB_BUSY_ERRORS.inc()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """SQLite connection that reports execute calls to query_stats trackers."""
+
+    def execute(self, sql, *args):
+        try:
+            return timed_execute(super().execute, sql, *args)
+        except sqlite3.OperationalError as e:
+            _count_busy(e)
+            raise
+
+    def executemany(self, sql, *args):
+        try:
+            return timed_execute(super().executemany, sql, *args)
+        except sqlite3.OperationalError as e:
+            _count_busy(e)
+            raise
+
+    def commit(self):
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            _count_busy(e)
+            raise
+
+
+class PooledConnection(InstrumentedConnection):
+    """SQLite connection whose close() hands it back to the pool instead of closing it."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def discard(self):
+        """Really close the underlying connection."""
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+
+    A thread that already holds a connection gets the same one back from
+    acquire(), so nested helpers (or a whole Flask request) share a single
+    connection. The connection returns to the pool when the outermost holder
+    closes it.
+    """
+
+    def __init__(self, database: str, size: int, timeout: float = POOL_TIMEOUT):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    def _connect(self) -> PooledConnection:
+        return connect(self.database, factory=PooledConnection, check_same_thread=False)
+
+    def _is_healthy(self, conn: PooledConnection) -> bool:
+        if time.monotonic() - conn.last_used < POOL_HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _checkout(self) -> PooledConnection:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._created < self.size:
+                        self._created += 1
+                        break
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError('Timed out waiting for a pooled database connection.')
+            if self._is_healthy(conn):
+                return conn
+            self._drop(conn)
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _drop(self, conn: PooledConnection):
+        with self._lock:
+            self._created -= 1
+        conn.discard()
+
+    def acquire(self) -> PooledConnection:
+        """Lease a connection for the current thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.depth += 1
+            return conn
+
+        conn = self._checkout()
+        conn.pool = self
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def release(self, conn: PooledConnection, force: bool = False):
+        """
+        Give back one lease; the outermost release returns the connection to the pool.
+
+        With force, the connection goes back however many leases are still open,
+        so a request teardown recovers it even if a helper failed to close it.
+        """
+        if getattr(self._local, 'conn', None) is not conn:
+            self._drop(conn)
+            return
+
+        self._local.depth = 0 if force else self._local.depth - 1
+        if self._local.depth > 0:
+            return
+        self._local.conn = None
+
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._drop(conn)
+            return
+
+        if self._closed:
+            self._drop(conn)
+            return
+        conn.last_used = time.monotonic()
+        self._idle.put(conn)
+
+    def close(self):
+        """Close every idle connection; leased ones are closed when released."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._drop(conn)
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ConnectionPool:
+    global _pool
+    pool = _pool
+    if pool is None or pool.database != DATABASE:
+        with _pool_lock:
+            if _pool is None or _pool.database != DATABASE:
+                if _pool is not None:
+                    _pool.close()
+                _pool = ConnectionPool(DATABASE, POOL_SIZE, POOL_TIMEOUT)
+            pool = _pool
+    return pool
+
+def configure_pool(size: Optional[int] = None, timeout: Optional[float] = None):
+    """Change the pool settings and drop the current pool so the next call picks them up."""
+    global POOL_SIZE, POOL_TIMEOUT, _pool
+    if size is not None:
+        POOL_SIZE = size
+    if timeout is not None:
+        POOL_TIMEOUT = timeout
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = None
+
+def configure_profile(name: str):
+    """Select the SQLite performance profile used for new connections."""
+    global DB_PROFILE
+    if name not in PERFORMANCE_PROFILES:
+        raise ValueError(f"Unknown database profile '{name}'. Choose from: {', '.join(PERFORMANCE_PROFILES)}.")
+    DB_PROFILE = name
+    configure_pool()
+
+def apply_profile(conn: sqlite3.Connection, include_journal_mode: bool = False):
+    """Apply the per-connection pragmas of the current profile."""
+    for pragma, value in PERFORMANCE_PROFILES[DB_PROFILE].items():
+        if pragma == 'journal_mode' and not include_journal_mode:
+            continue
+        conn.execute(f'PRAGMA {pragma} = {value}')
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+def connect(path: str, **kwargs) -> sqlite3.Connection:
+    """Open a new SQLite connection configured with the current profile."""
+    conn = sqlite3.connect(path, **kwargs)
     conn.row_factory = sqlite3.Row  # This enables column access by name
+    conn.create_function('casefold', 1, _casefold, deterministic=True)
+    apply_profile(conn)
     return conn
 
+# Database paths this process has already created and migrated
+_schema_ready = set()
+_schema_lock = threading.RLock()
+
+def _acquire_connection():
+    if POOL_SIZE <= 0:
+        return connect(DATABASE, factory=InstrumentedConnection)
+    return _get_pool().acquire()
+
+def get_db_connection():
+    """
+    Get a database connection (pooled unless POOL_SIZE is 0).
+
+    The first connection a process opens to a database runs init_database,
+    so an older library.db is migrated before any helper queries it.
+    """
+    if DATABASE not in _schema_ready:
+        with _schema_lock:
+            if DATABASE not in _schema_ready:
+                init_database()
+    return _acquire_connection()
+
+def release_connection(conn: sqlite3.Connection):
+    """Return a connection to its pool regardless of nested leases (or close an unpooled one)."""
+    pool = getattr(conn, 'pool', None)
+    if pool is not None:
+        pool.release(conn, force=True)
+    else:
+        conn.close()
+
+@timed_db_helper
 def init_database():
     """Initialize the database with required tables."""
-    conn = get_db_connection()
+    with _schema_lock:
+        _init_database()
+        _schema_ready.add(DATABASE)
+
+def _init_database():
+    conn = _acquire_connection()
+    try:
+        apply_profile(conn, include_journal_mode=True)
+    
+        # Create books table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS books (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                author TEXT NOT NULL,
+                isbn TEXT UNIQUE NOT NULL,
+                total_copies INTEGER NOT NULL,
+                available_copies INTEGER NOT NULL
+            )
+        ''')
     
-    # Create books table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            author TEXT NOT NULL,
-            isbn TEXT UNIQUE NOT NULL,
-            total_copies INTEGER NOT NULL,
-            available_copies INTEGER NOT NULL
-        )
-    ''')
+        # Create borrow_records table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS borrow_records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patron_id TEXT NOT NULL,
+                book_id INTEGER NOT NULL,
+                borrow_date TEXT NOT NULL,
+                due_date TEXT NOT NULL,
+                return_date TEXT,
+                FOREIGN KEY (book_id) REFERENCES books (id)
+            )
+        ''')
     
-    # Create borrow_records table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS borrow_records (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patron_id TEXT NOT NULL,
-            book_id INTEGER NOT NULL,
-            borrow_date TEXT NOT NULL,
-            due_date TEXT NOT NULL,
-            return_date TEXT,
-            FOREIGN KEY (book_id) REFERENCES books (id)
-        )
-    ''')
+        conn.commit()
     
-    conn.commit()
-    conn.close()
+        # Bring an existing database up to the latest schema version
+        run_migrations(conn)
+    finally:
+        conn.close()
 
+@timed_db_helper
 def add_sample_data():
     """Add sample data to the database if it's empty."""
     conn = get_db_connection()
-    book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
+    try:
+        book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
     
-    if book_count == 0:
-        # Add sample books
-        sample_books = [
-            ('The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3),
-            ('To Kill a Mockingbird', 'Harper Lee', '9780061120084', 2),
-            ('1984', 'George Orwell', '9780451524935', 1)
-        ]
+        if book_count == 0:
+            # Add sample books
+            sample_books = [
+                ('The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3),
+                ('To Kill a Mockingbird', 'Harper Lee', '9780061120084', 2),
+                ('1984', 'George Orwell', '9780451524935', 1)
+            ]
         
-        for title, author, isbn, copies in sample_books:
-            conn.execute('''
-                INSERT INTO books (title, author, isbn, total_copies, available_copies)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (title, author, isbn, copies, copies))
+            for title, author, isbn, copies in sample_books:
+                conn.execute('''
+                    INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (title, author, isbn, copies, copies))
         
-        # Make 1984 unavailable by adding a borrow record
-        conn.execute('''
-            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
-            VALUES (?, ?, ?, ?)
-        ''', ('123456', 3, 
-              (datetime.now() - timedelta(days=5)).isoformat(),
-              (datetime.now() + timedelta(days=9)).isoformat()))
+            # Make 1984 unavailable by adding a borrow record
+            conn.execute('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+            ''', ('123456', 3, 
+                  (datetime.now() - timedelta(days=5)).isoformat(),
+                  (datetime.now() + timedelta(days=9)).isoformat()))
         
-        # Update available copies for 1984
-        conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
+            # Update available copies for 1984
+            conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
         
-        conn.commit()
-    
-    conn.close()
+            conn.commit()
+    finally:
+        conn.close()
 
 # Helper Functions for Database Operations
 
+@timed_db_helper
 def get_all_books() -> List[Dict]:
     """Get all books from the database."""
     conn = get_db_connection()
-    books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
-    conn.close()
+    try:
+        books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
+    finally:
+        conn.close()
     return [dict(book) for book in books]
 
+def _cache_book(book: Dict):
+    book_cache.set((DATABASE, 'id', book['id']), book)
+    book_cache.set((DATABASE, 'isbn', book['isbn']), book['id'])
+
+def invalidate_book(book_id: int):
+    """Drop a book from the lookup cache after its row changes."""
+    book_cache.invalidate((DATABASE, 'id', book_id))
+
+def iter_books(chunk_size: int = 1000) -> Iterator[Dict]:
+    """
+    Yield every book ordered by id without loading the whole table.
+
+    Each chunk is a short keyset query (id > last id), so no read
+    transaction stays open while the caller consumes the rows.
+    """
+    last_id = 0
+    while True:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute('SELECT * FROM books WHERE id > ? ORDER BY id LIMIT ?',
+                                (last_id, chunk_size)).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row)
+        last_id = rows[-1]['id']
+
+@timed_db_helper
 def get_book_by_id(book_id: int) -> Optional[Dict]:
-    """Get a specific book by ID."""
+    """Get a specific book by ID (served from book_cache when possible)."""
+    cached = book_cache.get((DATABASE, 'id', book_id))
+    if cached is not None:
+        return dict(cached)
+    
     conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    try:
+        book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+    finally:
+        conn.close()
+    if not book:
+        return None
+    _cache_book(dict(book))
+    return dict(book)
 
+@timed_db_helper
 def get_book_by_isbn(isbn: str) -> Optional[Dict]:
-    """Get a specific book by ISBN."""
+    """Get a specific book by ISBN (served from book_cache when possible)."""
+    # ISBNs never change, so the cache maps ISBN -> id and reuses the id entry
+    book_id = book_cache.get((DATABASE, 'isbn', isbn))
+    if book_id is not None:
+        cached = book_cache.get((DATABASE, 'id', book_id))
+        if cached is not None:
+            return dict(cached)
+    
     conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    try:
+        book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
+    finally:
+        conn.close()
+    if not book:
+        return None
+    _cache_book(dict(book))
+    return dict(book)
 
+def _search_source(term: str, search_type: str) -> Tuple[str, List[str], List, bool]:
+    """Build the FROM clause, conditions and parameters for a catalog search."""
+    if search_type == 'isbn':
+        # ISBNs are digits (or a trailing X), so both cases cover a case-insensitive match
+        return 'books b', ['b.isbn IN (?, ?)'], [term, term.upper()], False
+    if len(term) >= 3:
+        phrase = term.replace('"', '""')
+        return ('books_fts JOIN books b ON b.id = books_fts.rowid', ['books_fts MATCH ?'],
+                [f'{search_type} : "{phrase}"'], True)
+    # LIKE only folds ASCII letters; casefold() is registered on every connection
+    return 'books b', [f'instr(casefold(b.{search_type}), ?) > 0'], [term.casefold()], False
+
+def _fetch_keyset_page(source: str, conditions: List[str], params: List,
+                       after: Optional[Tuple[str, int]], before: Optional[Tuple[str, int]],
+                       limit: int) -> List[Dict]:
+    """
+    Fetch up to `limit` books ordered by (title, id), strictly after or before a key.
+
+    The row-value comparison walks idx_books_title (title, rowid) instead of
+    skipping rows with OFFSET.
+    """
+    conditions = list(conditions)
+    params = list(params)
+    order = 'b.title, b.id'
+    if after is not None:
+        conditions.append('(b.title, b.id) > (?, ?)')
+        params.extend(after)
+    elif before is not None:
+        conditions.append('(b.title, b.id) < (?, ?)')
+        params.extend(before)
+        order = 'b.title DESC, b.id DESC'
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(f'SELECT b.* FROM {source} {where} ORDER BY {order} LIMIT ?',
+                            params + [limit]).fetchall()
+    finally:
+        conn.close()
+
+    books = [dict(row) for row in rows]
+    if before is not None:
+        books.reverse()
+    return books
+
+@timed_db_helper
+def get_books_page(after: Optional[Tuple[str, int]] = None, before: Optional[Tuple[str, int]] = None,
+                   limit: int = 50) -> List[Dict]:
+    """Get one page of the catalog ordered by (title, id)."""
+    return _fetch_keyset_page('books b', [], [], after, before, limit)
+
+@timed_db_helper
+def search_books(term: str, search_type: str, limit: int) -> List[Dict]:
+    """
+    Search books through the books_fts index.
+
+    Title and author searches are case-insensitive substring matches ranked
+    by bm25; terms shorter than three characters (below the trigram size)
+    fall back to a casefolded substring scan. ISBN searches are exact. search_type must already be
+    one of title, author or isbn.
+    """
+    version = get_catalog_version()
+    key = (DATABASE, version, term, search_type, limit)
+    cached = search_cache.get(key) if version is not None else None
+    if cached is not None:
+        return [dict(book) for book in cached]
+
+    source, conditions, params, ranked = _search_source(term, search_type)
+    order = 'books_fts.rank, b.title' if ranked else 'b.title'
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(f'''
+            SELECT b.* FROM {source}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {order}
+            LIMIT ?
+        ''', params + [limit]).fetchall()
+    finally:
+        conn.close()
+    books = [dict(row) for row in rows]
+    if version is not None:
+        search_cache.set(key, books)
+    return [dict(book) for book in books]
+
+@timed_db_helper
+def search_books_page(term: str, search_type: str, after: Optional[Tuple[str, int]] = None,
+                      before: Optional[Tuple[str, int]] = None, limit: int = 50) -> List[Dict]:
+    """Get one page of search matches ordered by (title, id) for keyset pagination."""
+    version = get_catalog_version()
+    key = (DATABASE, version, term, search_type, after, before, limit)
+    cached = search_cache.get(key) if version is not None else None
+    if cached is not None:
+        return [dict(book) for book in cached]
+
+    source, conditions, params, _ = _search_source(term, search_type)
+    books = _fetch_keyset_page(source, conditions, params, after, before, limit)
+    if version is not None:
+        search_cache.set(key, books)
+    return [dict(book) for book in books]
+
+@timed_db_helper
 def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
     """Get currently borrowed books for a patron."""
     conn = get_db_connection()
-    records = conn.execute('''
-        SELECT br.*, b.title, b.author 
-        FROM borrow_records br 
-        JOIN books b ON br.book_id = b.id 
-        WHERE br.patron_id = ? AND br.return_date IS NULL
-        ORDER BY br.borrow_date
-    ''', (patron_id,)).fetchall()
-    conn.close()
+    try:
+        records = conn.execute('''
+            SELECT br.book_id, br.borrow_date, br.due_date, br.due_ts, b.title, b.author 
+            FROM borrow_records br 
+            JOIN books b ON br.book_id = b.id 
+            WHERE br.patron_id = ? AND br.return_date IS NULL
+            ORDER BY br.borrow_date
+        ''', (patron_id,)).fetchall()
+    finally:
+        conn.close()
     
+    now_ts = to_epoch(datetime.now())
     borrowed_books = []
     for record in records:
         borrowed_books.append({
@@ -125,36 +671,222 @@ def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
             'author': record['author'],
             'borrow_date': datetime.fromisoformat(record['borrow_date']),
             'due_date': datetime.fromisoformat(record['due_date']),
-            'is_overdue': datetime.now() > datetime.fromisoformat(record['due_date'])
+            'is_overdue': now_ts > record['due_ts']
         })
     
     return borrowed_books
 
+@timed_db_helper
+def get_patron_borrow_records(patron_id: str) -> List[Dict]:
+    """Get every borrow record (open and returned) for a patron, newest first."""
+    conn = get_db_connection()
+    try:
+        records = conn.execute('''
+            SELECT br.*, b.title, b.author 
+            FROM borrow_records br
+            JOIN books b ON br.book_id = b.id
+            WHERE br.patron_id = ?
+            ORDER BY br.borrow_date DESC
+        ''', (patron_id,)).fetchall()
+    finally:
+        conn.close()
+    return [dict(record) for record in records]
+
+@timed_db_helper
+def get_overdue_loans(now_ts: int, after: Optional[Tuple[str, int, int]] = None, limit: int = 1000) -> List[Dict]:
+    """
+    Get one page of open loans due before now_ts, ordered by patron, due date and id.
+    
+    Pages are keyset range scans of idx_borrow_records_open_patron_due starting
+    after `after` = (patron_id, due_ts, id) of the previous page's last loan.
+    """
+    keyset = 'AND (br.patron_id, br.due_ts, br.id) > (?, ?, ?)' if after else ''
+    conn = get_db_connection()
+    try:
+        records = conn.execute(f'''
+            SELECT br.id, br.patron_id, br.book_id, br.borrow_date, br.due_date, br.due_ts, b.title, b.author
+            FROM borrow_records br
+            JOIN books b ON br.book_id = b.id
+            WHERE br.return_date IS NULL AND br.due_ts < ? {keyset}
+            ORDER BY br.patron_id, br.due_ts, br.id
+            LIMIT ?
+        ''', (now_ts, *(after or ()), limit)).fetchall()
+    finally:
+        conn.close()
+    return [dict(record) for record in records]
+
+def iter_overdue_loans(now_ts: int, chunk_size: int = 1000) -> Iterator[Dict]:
+    """Yield every loan overdue at now_ts in get_overdue_loans order, one short query per chunk."""
+    after = None
+    while True:
+        loans = get_overdue_loans(now_ts, after, chunk_size)
+        yield from loans
+        if len(loans) < chunk_size:
+            return
+        last = loans[-1]
+        after = (last['patron_id'], last['due_ts'], last['id'])
+
+@timed_db_helper
 def get_patron_borrow_count(patron_id: str) -> int:
-    """Get the number of books currently borrowed by a patron."""
+    """Get the number of books currently borrowed by a patron (from the patron_loans counter)."""
     conn = get_db_connection()
-    count = conn.execute('''
-        SELECT COUNT(*) as count FROM borrow_records 
-        WHERE patron_id = ? AND return_date IS NULL
-    ''', (patron_id,)).fetchone()['count']
-    conn.close()
-    return count
+    try:
+        row = conn.execute('SELECT active_loans FROM patron_loans WHERE patron_id = ?', (patron_id,)).fetchone()
+    finally:
+        conn.close()
+    return row['active_loans'] if row else 0
 
+@timed_db_helper
 def insert_book(title: str, author: str, isbn: str, total_copies: int, available_copies: int) -> bool:
     """Insert a new book into the database."""
     conn = get_db_connection()
     try:
-        conn.execute('''
+        book_id = conn.execute('''
             INSERT INTO books (title, author, isbn, total_copies, available_copies)
             VALUES (?, ?, ?, ?, ?)
-        ''', (title, author, isbn, total_copies, available_copies))
+        ''', (title, author, isbn, total_copies, available_copies)).lastrowid
         conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        return False
+    finally:
         conn.close()
-        return True
-    except Exception as e:
+    book_cache.invalidate((DATABASE, 'isbn', isbn))
+    _notify_book_insert([{'id': book_id, 'title': title, 'author': author}])
+    return True
+
+@timed_db_helper
+def find_existing_isbns(isbns: List[str]) -> set:
+    """Return the subset of `isbns` already present in the books table."""
+    found = set()
+    conn = get_db_connection()
+    try:
+        # Stay below SQLite's default limit on bound parameters
+        for start in range(0, len(isbns), 500):
+            chunk = isbns[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = conn.execute(f'SELECT isbn FROM books WHERE isbn IN ({placeholders})', chunk).fetchall()
+            found.update(row['isbn'] for row in rows)
+    finally:
         conn.close()
+    return found
+
+@timed_db_helper
+def insert_books_bulk(books: List[Tuple[str, str, str, int, int]]) -> bool:
+    """
+    Insert many (title, author, isbn, total_copies, available_copies) rows in one transaction.
+
+    Either every row is inserted or none is.
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', books)
+        conn.commit()
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
         return False
+    finally:
+        conn.close()
+    
+    for book in books:
+        book_cache.invalidate((DATABASE, 'isbn', book[2]))
+    _notify_book_insert(None)
+    return True
+
+@timed_db_helper
+def return_loans_bulk(returns: List[Tuple[str, int, datetime]]) -> Optional[List[Optional[Dict]]]:
+    """
+    Close the open loans matching many (patron_id, book_id, returned_at) records in one transaction.
+
+    Records are matched to open loans with set-based SQL: the n-th record for a
+    (patron, book) pair closes that pair's n-th oldest open loan. Return dates
+    and available_copies are then updated with one statement each.
 
+    A record whose returned_at is before its matched loan's borrow_date
+    leaves that loan open.
+
+    Returns:
+        list: per record, {loan_id, due_ts, return_ts} of the closed loan,
+        {loan_id: None, borrow_date} when returned_at precedes the borrow, or
+        None when the patron had no matching open loan; None on a database error
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS return_batch (
+                seq INTEGER PRIMARY KEY,
+                patron_id TEXT NOT NULL,
+                book_id INTEGER NOT NULL,
+                returned_at TEXT NOT NULL,
+                loan_id INTEGER,
+                borrow_date TEXT
+            )
+        ''')
+        conn.execute('DELETE FROM return_batch')
+        conn.executemany('INSERT INTO return_batch (seq, patron_id, book_id, returned_at) VALUES (?, ?, ?, ?)',
+                         ((seq, patron_id, book_id, returned_at.isoformat())
+                          for seq, (patron_id, book_id, returned_at) in enumerate(returns)))
+        # A record returned before its loan was borrowed leaves the loan open; both
+        # are naive local ISO timestamps, so they compare correctly as text
+        conn.execute('''
+            UPDATE return_batch
+            SET loan_id = CASE WHEN returned_at < matched.borrow_date THEN NULL ELSE matched.loan_id END,
+                borrow_date = CASE WHEN returned_at < matched.borrow_date THEN matched.borrow_date END
+            FROM (
+                WITH requested AS (
+                    SELECT seq, patron_id, book_id,
+                           ROW_NUMBER() OVER (PARTITION BY patron_id, book_id ORDER BY seq) AS n
+                    FROM return_batch
+                ), open_loans AS (
+                    SELECT id, patron_id, book_id, borrow_date,
+                           ROW_NUMBER() OVER (PARTITION BY patron_id, book_id ORDER BY borrow_date, id) AS n
+                    FROM borrow_records
+                    WHERE return_date IS NULL
+                      AND (patron_id, book_id) IN (SELECT patron_id, book_id FROM return_batch)
+                )
+                SELECT requested.seq, open_loans.id AS loan_id, open_loans.borrow_date
+                FROM requested JOIN open_loans USING (patron_id, book_id, n)
+            ) AS matched
+            WHERE return_batch.seq = matched.seq
+        ''')
+        conn.execute('''
+            UPDATE borrow_records SET return_date = rb.returned_at
+            FROM return_batch rb WHERE borrow_records.id = rb.loan_id
+        ''')
+        conn.execute('''
+            UPDATE books SET available_copies = available_copies + returned.n
+            FROM (SELECT book_id, COUNT(*) AS n FROM return_batch WHERE loan_id IS NOT NULL GROUP BY book_id) AS returned
+            WHERE books.id = returned.book_id
+        ''')
+        rows = conn.execute('''
+            SELECT rb.loan_id, rb.borrow_date, br.book_id, br.due_ts, br.return_ts
+            FROM return_batch rb LEFT JOIN borrow_records br ON br.id = rb.loan_id
+            ORDER BY rb.seq
+        ''').fetchall()
+        conn.execute('DELETE FROM return_batch')
+        conn.commit()
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+    for book_id in {row['book_id'] for row in rows if row['loan_id'] is not None}:
+        invalidate_book(book_id)
+    return [{'loan_id': row['loan_id'], 'due_ts': row['due_ts'], 'return_ts': row['return_ts']}
+            if row['loan_id'] is not None else
+            {'loan_id': None, 'borrow_date': row['borrow_date']} if row['borrow_date'] is not None else None
+            for row in rows]
+
+@timed_db_helper
 def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime) -> bool:
     """Insert a new borrow record into the database."""
     conn = get_db_connection()
@@ -164,12 +896,15 @@ def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, du
             VALUES (?, ?, ?, ?)
         ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
         conn.commit()
-        conn.close()
         return True
-    except Exception as e:
-        conn.close()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
         return False
+    finally:
+        conn.close()
 
+@timed_db_helper
 def update_book_availability(book_id: int, change: int) -> bool:
     """Update the available copies of a book by a given amount (+1 for return, -1 for borrow)."""
     conn = get_db_connection()
@@ -178,12 +913,16 @@ def update_book_availability(book_id: int, change: int) -> bool:
             UPDATE books SET available_copies = available_copies + ? WHERE id = ?
         ''', (change, book_id))
         conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        conn.close()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
         return False
+    finally:
+        conn.close()
+    invalidate_book(book_id)
+    return True
 
+@timed_db_helper
 def update_borrow_record_return_date(patron_id: str, book_id: int, return_date: datetime) -> bool:
     """Update the return date for a borrow record."""
     conn = get_db_connection()
@@ -194,8 +933,129 @@ def update_borrow_record_return_date(patron_id: str, book_id: int, return_date:
             WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
         ''', (return_date.isoformat(), patron_id, book_id))
         conn.commit()
-        conn.close()
         return True
-    except Exception as e:
-        conn.close()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
         return False
+    finally:
+        conn.close()
+
+@timed_db_helper
+def borrow_book_atomic(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime,
+                       max_books: int) -> Tuple[str, Optional[Dict]]:
+    """
+    Borrow a book in a single BEGIN IMMEDIATE transaction.
+
+    Checks the book, its availability and the patron's limit, inserts the loan
+    and decrements available_copies only while it is still positive, so
+    concurrent checkouts can never oversell a title.
+
+    Returns:
+        tuple: (one of the BORROW_* outcomes, the book row before the borrow or None)
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+        if not book:
+            conn.rollback()
+            return BORROW_BOOK_NOT_FOUND, None
+        if book['available_copies'] <= 0:
+            conn.rollback()
+            return BORROW_NOT_AVAILABLE, dict(book)
+
+        counter = conn.execute('SELECT active_loans FROM patron_loans WHERE patron_id = ?',
+                               (patron_id,)).fetchone()
+        if counter and counter['active_loans'] >= max_books:
+            conn.rollback()
+            return BORROW_LIMIT_REACHED, dict(book)
+
+        updated = conn.execute('''
+            UPDATE books SET available_copies = available_copies - 1
+            WHERE id = ? AND available_copies > 0
+        ''', (book_id,)).rowcount
+        if updated == 0:
+            conn.rollback()
+            return BORROW_NOT_AVAILABLE, dict(book)
+
+        conn.execute('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+            VALUES (?, ?, ?, ?)
+        ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+        conn.commit()
+        invalidate_book(book_id)
+        return BORROW_OK, dict(book)
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        return BORROW_DB_ERROR, None
+    finally:
+        conn.close()
+
+@timed_db_helper
+def borrow_books_atomic(patron_id: str, book_ids: List[int], borrow_date: datetime, due_date: datetime,
+                        max_books: int) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Borrow a cart of books in a single BEGIN IMMEDIATE transaction.
+
+    Missing and unavailable books fail on their own. If the books that can be
+    lent would take the patron past max_books, none of them are lent.
+
+    Returns:
+        list: (BORROW_* outcome, book row before the borrow or None) per entry of book_ids
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        placeholders = ', '.join('?' * len(book_ids))
+        books = {row['id']: dict(row) for row in conn.execute(
+            f'SELECT * FROM books WHERE id IN ({placeholders})', book_ids)}
+
+        results = []
+        lend = []
+        remaining = {book_id: book['available_copies'] for book_id, book in books.items()}
+        for book_id in book_ids:
+            book = books.get(book_id)
+            if book is None:
+                results.append((BORROW_BOOK_NOT_FOUND, None))
+            elif remaining[book_id] <= 0:
+                results.append((BORROW_NOT_AVAILABLE, book))
+            else:
+                remaining[book_id] -= 1
+                lend.append(book_id)
+                results.append((BORROW_OK, book))
+
+        counter = conn.execute('SELECT active_loans FROM patron_loans WHERE patron_id = ?',
+                               (patron_id,)).fetchone()
+        if (counter['active_loans'] if counter else 0) + len(lend) > max_books:
+            conn.rollback()
+            return [(BORROW_LIMIT_REACHED, book) if outcome == BORROW_OK else (outcome, book)
+                    for outcome, book in results]
+        if not lend:
+            conn.rollback()
+            return results
+
+        updated = conn.executemany('''
+            UPDATE books SET available_copies = available_copies - 1
+            WHERE id = ? AND available_copies > 0
+        ''', ((book_id,) for book_id in lend)).rowcount
+        if updated != len(lend):
+            conn.rollback()
+            return [(BORROW_DB_ERROR, None) if outcome == BORROW_OK else (outcome, book)
+                    for outcome, book in results]
+
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+            VALUES (?, ?, ?, ?)
+        ''', ((patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()) for book_id in lend))
+        conn.commit()
+        for book_id in set(lend):
+            invalidate_book(book_id)
+        return results
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        return [(BORROW_DB_ERROR, None) for _ in book_ids]
+    finally:
+        conn.close()
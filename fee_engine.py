@@ -0,0 +1,117 @@
+"""
+Fee Engine Module - Batch late fee calculation
+Computes late fees for every open loan at once and stores a dated snapshot.
+
+Run nightly with:
+
+    python fee_engine.py [YYYY-MM-DD]
+
+The arithmetic runs in NumPy (listed in requirements.txt); without it the
+same rules run as a plain Python loop.
+"""
+
+import sys
+from datetime import date, datetime
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from database import SECONDS_PER_DAY, epoch_day, get_db_connection
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - the fallback is tested by patching np to None
+    np = None
+
+# Late fee rules (R4); must match library_service.compute_late_fee
+FIRST_WEEK_DAYS = 7
+FIRST_WEEK_RATE = 0.50
+LATER_RATE = 1.00
+MAX_FEE = 15.00
+
+
+def _due_day(due: Union[str, int]) -> int:
+    if isinstance(due, str):
+        return epoch_day(date.fromisoformat(due[:10]))
+    return due // SECONDS_PER_DAY
+
+
+def compute_late_fees_batch(due_dates: Sequence[Union[str, int]], today: date) -> Tuple[List[int], List[float]]:
+    """
+    Apply the late fee rules to many due dates at once.
+
+    Args:
+        due_dates: due dates as ISO strings (only the date part is used) or
+            as due_ts epoch seconds
+        today: the date fees are calculated for
+
+    Returns:
+        tuple: (days_overdue per loan, fee_amount per loan)
+    """
+    today_day = epoch_day(today)
+    if np is None:
+        days = [max(today_day - _due_day(d), 0) for d in due_dates]
+        fees = [round(min(min(d, FIRST_WEEK_DAYS) * FIRST_WEEK_RATE
+                          + max(d - FIRST_WEEK_DAYS, 0) * LATER_RATE, MAX_FEE), 2) for d in days]
+        return days, fees
+
+    if due_dates and isinstance(due_dates[0], str):
+        due = np.array([d[:10] for d in due_dates], dtype='datetime64[D]').astype(np.int64)
+    else:
+        due = np.asarray(due_dates, dtype=np.int64) // SECONDS_PER_DAY
+    days = np.maximum(today_day - due, 0)
+    fees = (np.minimum(days, FIRST_WEEK_DAYS) * FIRST_WEEK_RATE
+            + np.maximum(days - FIRST_WEEK_DAYS, 0) * LATER_RATE)
+    fees = np.round(np.minimum(fees, MAX_FEE), 2)
+    return days.tolist(), fees.tolist()
+
+
+def run_fee_snapshot(as_of: Optional[date] = None) -> Dict:
+    """
+    Compute late fees for every open loan and store them in fee_snapshots.
+
+    Re-running for the same date replaces that day's snapshot.
+
+    Returns:
+        dict: snapshot_date, loans processed, overdue loans and the total fee
+    """
+    as_of = as_of or datetime.now().date()
+    snapshot_date = as_of.isoformat()
+
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('''
+            SELECT id, patron_id, book_id, due_ts FROM borrow_records
+            WHERE return_date IS NULL
+        ''').fetchall()
+        days, fees = compute_late_fees_batch([row['due_ts'] for row in rows], as_of)
+
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM fee_snapshots WHERE snapshot_date = ?', (snapshot_date,))
+        conn.executemany('''
+            INSERT INTO fee_snapshots (snapshot_date, borrow_record_id, patron_id, book_id, days_overdue, fee_amount)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', ((snapshot_date, row['id'], row['patron_id'], row['book_id'], d, f)
+              for row, d, f in zip(rows, days, fees)))
+        conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return {
+        'snapshot_date': snapshot_date,
+        'loans': len(rows),
+        'overdue': sum(1 for d in days if d > 0),
+        'total_fees': round(sum(fees), 2),
+    }
+
+
+if __name__ == '__main__':
+    from database import init_database
+
+    init_database()
+    as_of = date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None
+    summary = run_fee_snapshot(as_of)
+    print(f"{summary['snapshot_date']}: {summary['loans']} open loans, "
+          f"{summary['overdue']} overdue, ${summary['total_fees']:.2f} in late fees")
@@ -0,0 +1,188 @@
+"""
+Idempotency Module - Safe retries for borrow and return requests
+A POST to one of IDEMPOTENT_ENDPOINTS that carries an Idempotency-Key header
+runs once. Retries with the same key until the key expires get the stored
+response back without touching books or borrow_records again.
+
+Keys live in the idempotency_keys table for IDEMPOTENCY_TTL seconds (or
+LIBRARY_IDEMPOTENCY_TTL). Reusing a key for a different request is rejected
+with 422, and a retry that arrives while the first request is still running
+gets 409. That reservation only holds for IDEMPOTENCY_LEASE seconds, so a
+worker that dies mid-request blocks retries for the lease, not the whole TTL.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from database import get_db_connection
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+IDEMPOTENCY_TTL = int(os.environ.get('LIBRARY_IDEMPOTENCY_TTL', str(24 * 60 * 60)))
+# Seconds an unfinished request holds its key before a retry may take it over
+IDEMPOTENCY_LEASE = int(os.environ.get('LIBRARY_IDEMPOTENCY_LEASE', '60'))
+MAX_KEY_LENGTH = 255
+PURGE_INTERVAL = 300
+IDEMPOTENT_ENDPOINTS = {
+    'borrowing.borrow_book',
+    'borrowing.return_book',
+    'api.borrow_batch_api',
+    'api.bulk_returns_api',
+}
+
+_last_purge = 0.0
+
+
+def reserve_key(key: str, fingerprint: str, lease: int, now: Optional[int] = None) -> Optional[Dict]:
+    """
+    Claim a key for a new request for `lease` seconds.
+
+    A reservation whose lease ran out without a stored response (its worker
+    died) counts as free, so the retry takes it over.
+
+    Returns:
+        None if the key was free (or expired) and is now reserved, otherwise
+        the stored row; its status is None while the first request is running
+    """
+    now = now if now is not None else int(time.time())
+    _purge_periodically(now)
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT * FROM idempotency_keys WHERE key = ? AND expires_at > ?', (key, now)).fetchone()
+        if row:
+            conn.rollback()
+            return dict(row)
+        conn.execute('''
+            INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, expires_at) VALUES (?, ?, ?)
+        ''', (key, fingerprint, now + lease))
+        conn.commit()
+        return None
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def store_response(key: str, status: int, content_type: Optional[str], location: Optional[str],
+                   flashes: List[Tuple[str, str]], body: bytes, ttl: int, now: Optional[int] = None):
+    """Save the response of a reserved key and keep it for `ttl` seconds so retries can replay it."""
+    now = now if now is not None else int(time.time())
+    conn = get_db_connection()
+    try:
+        conn.execute('''
+            UPDATE idempotency_keys
+            SET status = ?, content_type = ?, location = ?, flashes = ?, body = ?, expires_at = ?
+            WHERE key = ?
+        ''', (status, content_type, location, json.dumps(flashes) if flashes else None, body, now + ttl, key))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def release_key(key: str):
+    """Forget a reservation whose request failed, so the client can retry it."""
+    conn = get_db_connection()
+    try:
+        conn.execute('DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL', (key,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def purge_expired_keys(now: Optional[int] = None) -> int:
+    """Delete expired keys and return how many were removed."""
+    now = now if now is not None else int(time.time())
+    conn = get_db_connection()
+    try:
+        removed = conn.execute('DELETE FROM idempotency_keys WHERE expires_at <= ?', (now,)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return removed
+
+
+def _purge_periodically(now: int):
+    global _last_purge
+    if now - _last_purge >= PURGE_INTERVAL:
+        _last_purge = now
+        purge_expired_keys(now)
+
+
+def request_fingerprint(request) -> str:
+    """
+    Hash what identifies a request: method, path, query string and its form
+    fields, uploaded files or body. Raw bodies are buffered with
+    get_data(cache=True), so the view can still read them afterwards.
+    """
+    digest = hashlib.sha256(f'{request.method} {request.full_path}'.encode())
+    if request.mimetype in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        for name, value in sorted(request.form.items(multi=True)):
+            digest.update(f'{name}={value}\n'.encode())
+        for name, upload in sorted(request.files.items(multi=True), key=lambda item: item[0]):
+            digest.update(name.encode() + upload.read())
+            upload.seek(0)
+    elif request.is_json:
+        digest.update(json.dumps(request.get_json(silent=True), sort_keys=True).encode())
+    else:
+        digest.update(f'{request.mimetype}\n'.encode())
+        digest.update(request.get_data(cache=True))
+    return digest.hexdigest()[:32]
+
+
+def init_app(app):
+    """Replay stored responses for retried requests that reuse an Idempotency-Key."""
+    from flask import Response, flash, g, jsonify, request, session
+
+    app.config.setdefault('IDEMPOTENCY_TTL', IDEMPOTENCY_TTL)
+    app.config.setdefault('IDEMPOTENCY_LEASE', IDEMPOTENCY_LEASE)
+
+    @app.before_request
+    def check_idempotency_key():
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or request.method != 'POST' or request.endpoint not in IDEMPOTENT_ENDPOINTS:
+            return None
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters'}), 400
+
+        fingerprint = request_fingerprint(request)
+        lease = min(app.config['IDEMPOTENCY_LEASE'], app.config['IDEMPOTENCY_TTL'])
+        stored = reserve_key(key, fingerprint, lease)
+        if stored is None:
+            g.idempotency_key = key
+            return None
+        if stored['fingerprint'] != fingerprint:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'}), 422
+        if stored['status'] is None:
+            return jsonify({'error': f'A request with this {IDEMPOTENCY_HEADER} is still in progress'}), 409
+
+        for category, message in json.loads(stored['flashes'] or '[]'):
+            flash(message, category)
+        response = Response(stored['body'], status=stored['status'], content_type=stored['content_type'])
+        if stored['location']:
+            response.headers['Location'] = stored['location']
+        response.headers[REPLAYED_HEADER] = 'true'
+        return response
+
+    @app.after_request
+    def save_idempotent_response(response):
+        key = g.pop('idempotency_key', None)
+        if key is None:
+            return response
+        if response.status_code >= 500:
+            release_key(key)
+        else:
+            store_response(key, response.status_code, response.content_type, response.headers.get('Location'),
+                           session.get('_flashes', []), response.get_data(), app.config['IDEMPOTENCY_TTL'])
+        return response
+
+    @app.teardown_request
+    def release_unfinished_key(exc):
+        key = g.pop('idempotency_key', None)
+        if key is not None:
+            release_key(key)
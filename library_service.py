@@ -3,47 +3,78 @@ Library Service Module - Business Logic Functions
 Contains all the core business logic for the Library Management System
 """
 
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+import base64
+import json
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from database import (
-    get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
-    insert_book, insert_borrow_record, update_book_availability,
-    update_borrow_record_return_date, get_all_books, get_patron_borrowed_books,
-    get_db_connection
+    get_book_by_id, get_book_by_isbn, insert_book, update_book_availability,
+    update_borrow_record_return_date, get_patron_borrowed_books, get_patron_borrow_records,
+    borrow_book_atomic, borrow_books_atomic, search_books, get_books_page, search_books_page,
+    get_overdue_loans, iter_overdue_loans, epoch_day, to_epoch, EPOCH, SECONDS_PER_DAY,
+    BORROW_OK, BORROW_BOOK_NOT_FOUND, BORROW_NOT_AVAILABLE, BORROW_LIMIT_REACHED
 )
+from suggest import get_index, SUGGEST_TYPES
 
-def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
+# Maximum number of books a patron may have checked out at once (R3)
+MAX_BORROWED_BOOKS = 5
+
+# Maximum number of results returned by a catalog search
+SEARCH_RESULT_LIMIT = 100
+
+# Page sizes for the paginated catalog and search API
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Completions returned by the search-as-you-type endpoint
+DEFAULT_SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+
+def validate_book_fields(title: str, author: str, isbn: str, total_copies: int) -> Optional[str]:
     """
-    Add a new book to the catalog.
-    Implements R1: Book Catalog Management
+    Check the R1 rules for a new book.
     
-    Args:
-        title: Book title (max 200 chars)
-        author: Book author (max 100 chars)
-        isbn: 13-digit ISBN
-        total_copies: Number of copies (positive integer)
-        
     Returns:
-        tuple: (success: bool, message: str)
+        str: the first validation error message, or None if the fields are valid
     """
-    # Input validation
     if not title or not title.strip():
-        return False, "Title is required."
+        return "Title is required."
     
     if len(title.strip()) > 200:
-        return False, "Title must be less than 200 characters."
+        return "Title must be less than 200 characters."
     
     if not author or not author.strip():
-        return False, "Author is required."
+        return "Author is required."
     
     if len(author.strip()) > 100:
-        return False, "Author must be less than 100 characters."
+        return "Author must be less than 100 characters."
     
     if len(isbn) != 13:
-        return False, "ISBN must be exactly 13 digits."
+        return "ISBN must be exactly 13 digits."
     
     if not isinstance(total_copies, int) or total_copies <= 0:
-        return False, "Total copies must be a positive integer."
+        return "Total copies must be a positive integer."
+    
+    return None
+
+def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
+    """
+    Add a new book to the catalog.
+    Implements R1: Book Catalog Management
+    
+    Args:
+        title: Book title (max 200 chars)
+        author: Book author (max 100 chars)
+        isbn: 13-digit ISBN
+        total_copies: Number of copies (positive integer)
+        
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    # Input validation
+    error = validate_book_fields(title, author, isbn, total_copies)
+    if error:
+        return False, error
     
     # Check for duplicate ISBN
     existing = get_book_by_isbn(isbn)
@@ -73,34 +104,68 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits."
     
-    # Check if book exists and is available
-    book = get_book_by_id(book_id)
-    if not book:
+    # Check availability and the borrowing limit, record the loan and
+    # decrement the available copies in one transaction
+    borrow_date = datetime.now()
+    due_date = borrow_date + timedelta(days=14)
+    outcome, book = borrow_book_atomic(patron_id, book_id, borrow_date, due_date, MAX_BORROWED_BOOKS)
+    return _borrow_message(outcome, book, due_date)
+
+def _borrow_message(outcome: str, book: Optional[Dict], due_date: datetime) -> Tuple[bool, str]:
+    """Turn a BORROW_* outcome into the (success, message) shown to the patron."""
+    if outcome == BORROW_BOOK_NOT_FOUND:
         return False, "Book not found."
     
-    if book['available_copies'] <= 0:
+    if outcome == BORROW_NOT_AVAILABLE:
         return False, "This book is currently not available."
     
-    # Check patron's current borrowed books count
-    current_borrowed = get_patron_borrow_count(patron_id)
-    
-    if current_borrowed > 5:
+    if outcome == BORROW_LIMIT_REACHED:
         return False, "You have reached the maximum borrowing limit of 5 books."
     
-    # Create borrow record
+    if outcome != BORROW_OK:
+        return False, "Database error occurred while creating borrow record."
+    
+    return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
+
+def borrow_books_by_patron(patron_id: str, book_ids: List[int]) -> Dict:
+    """
+    Check out a cart of books for one patron in a single transaction.
+    
+    Each book succeeds or fails on its own (not found, unavailable), but the
+    borrowing limit applies to the whole cart: if the lendable books would take
+    the patron past MAX_BORROWED_BOOKS, none of them are borrowed.
+    
+    Returns:
+        dict: success (at least one book borrowed), message, borrowed count and
+        one {book_id, success, message} item per requested book
+    """
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return {"success": False, "message": "Invalid patron ID. Must be exactly 6 digits.", "borrowed": 0, "items": []}
+    
+    if not book_ids or not all(type(book_id) is int for book_id in book_ids):
+        return {"success": False, "message": "Book IDs must be a non-empty list of integers.", "borrowed": 0, "items": []}
+    
+    if len(book_ids) > MAX_BORROWED_BOOKS:
+        return {"success": False, "message": f"A cart can hold at most {MAX_BORROWED_BOOKS} books.",
+                "borrowed": 0, "items": []}
+    
     borrow_date = datetime.now()
     due_date = borrow_date + timedelta(days=14)
+    outcomes = borrow_books_atomic(patron_id, book_ids, borrow_date, due_date, MAX_BORROWED_BOOKS)
     
-    # Insert borrow record and update availability
-    borrow_success = insert_borrow_record(patron_id, book_id, borrow_date, due_date)
-    if not borrow_success:
-        return False, "Database error occurred while creating borrow record."
-    
-    availability_success = update_book_availability(book_id, -1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability."
+    items = []
+    for book_id, (outcome, book) in zip(book_ids, outcomes):
+        success, message = _borrow_message(outcome, book, due_date)
+        items.append({"book_id": book_id, "success": success, "message": message})
+    borrowed = sum(1 for item in items if item["success"])
     
-    return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
+    return {
+        "success": borrowed > 0,
+        "message": f"Borrowed {borrowed} of {len(book_ids)} books. Due date: {due_date.strftime('%Y-%m-%d')}."
+                   if borrowed else "No books were borrowed.",
+        "borrowed": borrowed,
+        "items": items,
+    }
 
 def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
@@ -172,7 +237,21 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
     if due_date is str:
         due_date = datetime.fromisoformat(due_date)
     
-    days_overdue = max((datetime.now().date() - due_date.date()).days, 0)
+    return compute_late_fee(due_date)
+
+def compute_late_fee(due_date: datetime, today: Optional[date] = None) -> Dict:
+    """
+    Apply the late fee rules to a single due date.
+    $0.50/day for first 7 days overdue
+    $1.00/day for each additional day after 7 days
+    Maximum $15.00 per book
+    """
+    today = today or datetime.now().date()
+    return late_fee_for_days((today - due_date.date()).days)
+
+def late_fee_for_days(days_overdue: int) -> Dict:
+    """Apply the late fee rules to a number of days past the due date."""
+    days_overdue = max(days_overdue, 0)
 
     if days_overdue <= 0:
         fee = 0.00
@@ -191,11 +270,11 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
         "status": status
     }
 
-def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
+def search_books_in_catalog(search_term: str, search_type: str, limit: int = SEARCH_RESULT_LIMIT) -> List[Dict]:
     """
     Search for books in the catalog.
-    
-    TODO: N/A
+    Title and author searches are case-insensitive partial matches ranked by
+    relevance; ISBN searches are exact. At most `limit` books are returned.
     """
 
     if not search_term:
@@ -207,21 +286,106 @@ def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
         search_type = "title"
 
     term = search_term.strip().lower()
-    books = get_all_books()
-    results = []
+    return search_books(term, search_type, limit)
 
-    for i in books:
-        value = str(i.get(search_type, "")).lower()
-        
-        # Looks for partial text matches or identical id matches
-        if search_type in {"title", "author"}:
-            if term in value:
-                results.append(i)
-        elif search_type == "isbn":
-            if i.get("isbn", "").lower() == term:
-                results.append(i)
 
-    return results
+def suggest_completions(prefix: str, suggest_type: str = "title", limit: Optional[int] = DEFAULT_SUGGEST_LIMIT) -> List[Dict]:
+    """
+    Complete a partially typed title or author, most borrowed first.
+    Title suggestions are books; author suggestions are distinct authors with
+    their book count and combined borrows. Raises ValueError for an unknown type.
+    """
+    suggest_type = (suggest_type or "title").lower()
+    if suggest_type not in SUGGEST_TYPES:
+        raise ValueError("Suggest type must be 'title' or 'author'")
+    if not prefix or not prefix.strip():
+        return []
+    limit = max(1, min(limit or DEFAULT_SUGGEST_LIMIT, MAX_SUGGEST_LIMIT))
+    return get_index().suggest(prefix, suggest_type, limit)
+
+
+def encode_cursor(direction: str, book: Dict) -> str:
+    """Encode a (title, id) keyset position as an opaque URL-safe cursor."""
+    payload = json.dumps([direction, book["title"], book["id"]]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, Tuple[str, int]]:
+    """
+    Decode a cursor produced by encode_cursor.
+    
+    Returns:
+        tuple: (direction: "after" or "before", (title, id))
+    
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, title, book_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid page cursor.")
+    if direction not in {"after", "before"} or not isinstance(title, str) or not isinstance(book_id, int):
+        raise ValueError("Invalid page cursor.")
+    return direction, (title, book_id)
+
+def clamp_page_size(page_size: Optional[int]) -> int:
+    """Keep a requested page size between 1 and MAX_PAGE_SIZE."""
+    if not page_size or page_size <= 0:
+        return DEFAULT_PAGE_SIZE
+    return min(page_size, MAX_PAGE_SIZE)
+
+def _paginate(fetch, cursor: Optional[str], page_size: Optional[int]) -> Dict:
+    """Fetch one keyset page plus one extra row to tell whether another page exists."""
+    page_size = clamp_page_size(page_size)
+    after = before = None
+    if cursor:
+        direction, key = decode_cursor(cursor)
+        if direction == "after":
+            after = key
+        else:
+            before = key
+
+    books = fetch(after, before, page_size + 1)
+    has_more = len(books) > page_size
+    if before is not None:
+        books = books[-page_size:] if has_more else books
+        has_prev, has_next = has_more, True
+    else:
+        books = books[:page_size]
+        has_prev, has_next = after is not None, has_more
+
+    return {
+        "books": books,
+        "page_size": page_size,
+        "next_cursor": encode_cursor("after", books[-1]) if has_next and books else None,
+        "prev_cursor": encode_cursor("before", books[0]) if has_prev and books else None,
+    }
+
+def get_catalog_page(cursor: Optional[str] = None, page_size: Optional[int] = DEFAULT_PAGE_SIZE) -> Dict:
+    """
+    Get one page of the catalog ordered by title.
+    
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    return _paginate(get_books_page, cursor, page_size)
+
+def search_books_in_catalog_page(search_term: str, search_type: str, cursor: Optional[str] = None,
+                                 page_size: Optional[int] = DEFAULT_PAGE_SIZE) -> Dict:
+    """
+    Get one page of search results ordered by title, with the same matching
+    rules as search_books_in_catalog.
+    
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    search_type = (search_type or "title").lower()
+    if search_type not in {"title", "author", "isbn"}:
+        search_type = "title"
+    term = (search_term or "").strip().lower()
+
+    return _paginate(lambda after, before, limit: search_books_page(term, search_type, after, before, limit),
+                     cursor, page_size)
 
 
 def get_patron_status_report(patron_id: str) -> Dict:
@@ -241,39 +405,29 @@ def get_patron_status_report(patron_id: str) -> Dict:
             "total_late_fee": 0.00,
         }
     
-    # Compile borrowed books via iteration
-    borrowed_books = get_patron_borrowed_books(patron_id)
+    # One query returns every loan; open loans and fees are derived from it
+    records = get_patron_borrow_records(patron_id)
+    today = epoch_day(datetime.now().date())
     borrowed_details = []
     total_fees = 0.00
 
-    for book in borrowed_books:
-        book_id = book["book_id"]
-        fee_info = calculate_late_fee_for_book(patron_id, book_id)
+    open_records = sorted((r for r in records if r["return_date"] is None), key=lambda r: r["borrow_date"])
+    for record in open_records:
+        fee_info = late_fee_for_days(today - record["due_ts"] // SECONDS_PER_DAY)
         borrowed_details.append({
-            "book_id": book_id,
-            "title": book["title"],
-            "author": book["author"],
-            "borrow_date": book["borrow_date"],
-            "due_date": book["due_date"],
+            "book_id": record["book_id"],
+            "title": record["title"],
+            "author": record["author"],
+            "borrow_date": datetime.fromisoformat(record["borrow_date"]),
+            "due_date": datetime.fromisoformat(record["due_date"]),
             "days_overdue": fee_info["days_overdue"],
             "late_fee": fee_info["fee_amount"],
             "status": fee_info["status"],
         })
         total_fees += fee_info["fee_amount"]
 
-    # Retrieve borrowing history w/ calls
-    conn = get_db_connection()
-    rows = conn.execute('''
-        SELECT br.*, b.title, b.author 
-        FROM borrow_records br
-        JOIN books b ON br.book_id = b.id
-        WHERE br.patron_id = ?
-        ORDER BY br.borrow_date DESC
-    ''', (patron_id,)).fetchall()
-    conn.close()
-
     history = []
-    for record in rows:
+    for record in records:
         history.append({
             "book_id": record["book_id"],
             "title": record["title"],
@@ -285,8 +439,100 @@ def get_patron_status_report(patron_id: str) -> Dict:
 
     return {
         "patron_id": patron_id,
-        "borrow_count": len(borrowed_books),
+        "borrow_count": len(borrowed_details),
         "borrowed_books": borrowed_details,
         "borrowing_history": history,
         "total_late_fee": round(total_fees, 2),
     }
+
+def encode_overdue_cursor(now_ts: int, loan: Dict) -> str:
+    """Encode the scan time and a (patron_id, due_ts, id) position as an opaque cursor."""
+    payload = json.dumps([now_ts, loan["patron_id"], loan["due_ts"], loan["id"]]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_overdue_cursor(cursor: str) -> Tuple[int, Tuple[str, int, int]]:
+    """
+    Decode a cursor produced by encode_overdue_cursor.
+    
+    Returns:
+        tuple: (now_ts the scan started at, (patron_id, due_ts, id))
+    
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        now_ts, patron_id, due_ts, loan_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid page cursor.")
+    if not isinstance(patron_id, str) or not all(isinstance(v, int) for v in (now_ts, due_ts, loan_id)):
+        raise ValueError("Invalid page cursor.")
+    return now_ts, (patron_id, due_ts, loan_id)
+
+def _overdue_loan(loan: Dict, today: int) -> Dict:
+    fee_info = late_fee_for_days(today - loan["due_ts"] // SECONDS_PER_DAY)
+    return {
+        "book_id": loan["book_id"],
+        "title": loan["title"],
+        "author": loan["author"],
+        "borrow_date": loan["borrow_date"],
+        "due_date": loan["due_date"],
+        "days_overdue": fee_info["days_overdue"],
+        "late_fee": fee_info["fee_amount"],
+    }
+
+def _group_overdue_loans(loans: Iterable[Dict], today: int) -> Iterator[Dict]:
+    """Fold loans ordered by patron into one {patron_id, loans, total_late_fee} entry per patron."""
+    group = None
+    for loan in loans:
+        if group is None or group["patron_id"] != loan["patron_id"]:
+            if group is not None:
+                group["total_late_fee"] = round(group["total_late_fee"], 2)
+                yield group
+            group = {"patron_id": loan["patron_id"], "loans": [], "total_late_fee": 0.00}
+        entry = _overdue_loan(loan, today)
+        group["loans"].append(entry)
+        group["total_late_fee"] += entry["late_fee"]
+    if group is not None:
+        group["total_late_fee"] = round(group["total_late_fee"], 2)
+        yield group
+
+def get_overdue_loans_page(cursor: Optional[str] = None, page_size: Optional[int] = DEFAULT_PAGE_SIZE,
+                           as_of: Optional[datetime] = None) -> Dict:
+    """
+    Get one page of overdue loans grouped by patron.
+    
+    A page holds up to page_size loans, so one patron's loans can continue on
+    the next page. Every page of a cursor chain uses the time of the first
+    page, so loans do not shift while a client pages through them.
+    
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    page_size = clamp_page_size(page_size)
+    after = None
+    if cursor:
+        now_ts, after = decode_overdue_cursor(cursor)
+    else:
+        now_ts = to_epoch(as_of or datetime.now())
+
+    loans = get_overdue_loans(now_ts, after, page_size + 1)
+    has_more = len(loans) > page_size
+    loans = loans[:page_size]
+    return {
+        "as_of": (EPOCH + timedelta(seconds=now_ts)).isoformat(),
+        "patrons": list(_group_overdue_loans(loans, now_ts // SECONDS_PER_DAY)),
+        "loan_count": len(loans),
+        "page_size": page_size,
+        "next_cursor": encode_overdue_cursor(now_ts, loans[-1]) if has_more else None,
+    }
+
+def iter_overdue_patrons(as_of: Optional[datetime] = None, chunk_size: int = 1000) -> Iterator[Dict]:
+    """
+    Yield every patron with overdue loans, with those loans and their fees.
+    
+    Loans are read chunk_size at a time, so memory use does not grow with the
+    number of overdue loans.
+    """
+    now_ts = to_epoch(as_of or datetime.now())
+    yield from _group_overdue_loans(iter_overdue_loans(now_ts, chunk_size), now_ts // SECONDS_PER_DAY)
@@ -0,0 +1,111 @@
+"""
+Loan Counters Module - Reconciliation of the active loan counter cache
+patron_loans and book_loans are maintained by triggers on borrow_records
+(migration 7). This module checks them, and books.available_copies, against
+a full aggregate of open loans and can rewrite them from it.
+
+    python loan_counters.py [--repair]
+"""
+
+import argparse
+import sys
+from typing import Dict, List, Optional, Sequence
+
+from database import book_cache, get_db_connection
+
+OPEN_LOANS_BY_PATRON = '''
+    SELECT patron_id, COUNT(*) AS n FROM borrow_records WHERE return_date IS NULL GROUP BY patron_id
+'''
+OPEN_LOANS_BY_BOOK = '''
+    SELECT book_id, COUNT(*) AS n FROM borrow_records WHERE return_date IS NULL GROUP BY book_id
+'''
+
+
+def _counter_mismatches(conn, aggregate: str, table: str, key: str) -> List[Dict]:
+    rows = conn.execute(f'''
+        WITH actual AS ({aggregate})
+        SELECT a.{key} AS key, a.n AS expected, COALESCE(c.active_loans, 0) AS stored
+        FROM actual a LEFT JOIN {table} c ON c.{key} = a.{key}
+        WHERE a.n != COALESCE(c.active_loans, 0)
+        UNION ALL
+        SELECT c.{key}, 0, c.active_loans FROM {table} c
+        WHERE c.active_loans != 0 AND NOT EXISTS (SELECT 1 FROM actual a WHERE a.{key} = c.{key})
+    ''').fetchall()
+    return [{key: row['key'], 'expected': row['expected'], 'stored': row['stored']} for row in rows]
+
+
+def _availability_mismatches(conn) -> List[Dict]:
+    rows = conn.execute(f'''
+        WITH actual AS ({OPEN_LOANS_BY_BOOK})
+        SELECT b.id, b.available_copies, MAX(b.total_copies - COALESCE(a.n, 0), 0) AS expected
+        FROM books b LEFT JOIN actual a ON a.book_id = b.id
+        WHERE b.available_copies != MAX(b.total_copies - COALESCE(a.n, 0), 0)
+    ''').fetchall()
+    return [{'book_id': row['id'], 'expected': row['expected'], 'stored': row['available_copies']}
+            for row in rows]
+
+
+def reconcile_loan_counters(repair: bool = False) -> Dict:
+    """
+    Compare the loan counters with the borrow_records they summarize.
+
+    Args:
+        repair: rewrite patron_loans and book_loans from the aggregate and reset
+            drifted available_copies to total_copies minus open loans
+
+    Returns:
+        dict: patron, book and availability mismatches (each a list of
+        {key, expected, stored}) and whether they were repaired
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        report = {
+            'patrons': _counter_mismatches(conn, OPEN_LOANS_BY_PATRON, 'patron_loans', 'patron_id'),
+            'books': _counter_mismatches(conn, OPEN_LOANS_BY_BOOK, 'book_loans', 'book_id'),
+            'availability': _availability_mismatches(conn),
+            'repaired': False,
+        }
+        if repair and (report['patrons'] or report['books'] or report['availability']):
+            conn.execute('DELETE FROM patron_loans')
+            conn.execute(f'INSERT INTO patron_loans (patron_id, active_loans) {OPEN_LOANS_BY_PATRON}')
+            conn.execute('DELETE FROM book_loans')
+            conn.execute(f'INSERT INTO book_loans (book_id, active_loans) {OPEN_LOANS_BY_BOOK}')
+            conn.executemany('UPDATE books SET available_copies = ? WHERE id = ?',
+                             ((row['expected'], row['book_id']) for row in report['availability']))
+            report['repaired'] = True
+        conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if report['repaired'] and report['availability']:
+        book_cache.clear()
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Verify the active loan counters against borrow_records.')
+    parser.add_argument('--repair', action='store_true', help='rewrite drifted counters and available copies')
+    args = parser.parse_args(argv)
+
+    from database import init_database
+
+    init_database()
+    report = reconcile_loan_counters(repair=args.repair)
+    for name in ('patrons', 'books', 'availability'):
+        mismatches = report[name]
+        print(f'{name}: {len(mismatches)} mismatched')
+        for row in mismatches[:20]:
+            print(f'  {row}')
+    if report['repaired']:
+        print('Counters repaired.')
+        return 0
+    return 1 if any(report[name] for name in ('patrons', 'books', 'availability')) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
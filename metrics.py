@@ -0,0 +1,179 @@
+"""
+Metrics Module - Prometheus-style instrumentation
+Request counters, latency histograms and database helper timings, rendered
+in the Prometheus text exposition format by the /metrics route
+"""
+
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Set LIBRARY_METRICS_ENABLED=0 to turn recording off entirely
+METRICS_ENABLED = os.environ.get('LIBRARY_METRICS_ENABLED', '1') != '0'
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Counter:
+    """Monotonically increasing count per label combination."""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value:g}')
+        return lines
+
+
+class Histogram:
+    """Bucketed observations (e.g. latencies in seconds) per label combination."""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last slot is +Inf), sum, count]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, ([*s[0]], s[1], s[2])) for key, s in self._series.items())
+        for label_values, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                labels = _format_labels(self.labels, label_values, f'le="{le}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {total:.6f}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """Holds metrics plus callbacks that contribute extra exposition lines."""
+
+    def __init__(self):
+        self.metrics: List = []
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'library_http_requests_total', 'HTTP requests by endpoint, method and status.',
+    ('endpoint', 'method', 'status')))
+HTTP_ERRORS = REGISTRY.register(Counter(
+    'library_http_request_errors_total', 'HTTP requests that ended in a 5xx response.',
+    ('endpoint', 'method')))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'library_http_request_duration_seconds', 'HTTP request latency in seconds.',
+    ('endpoint', 'method')))
+DB_CALL_LATENCY = REGISTRY.register(Histogram(
+    'library_db_call_duration_seconds', 'Latency of database.py helper calls in seconds.',
+    ('helper',)))
+DB_BUSY_ERRORS = REGISTRY.register(Counter(
+    'library_db_busy_errors_total', 'Statements that failed with SQLITE_BUSY (database is locked).'))
+
+
+def timed_db_helper(func):
+    """Decorator recording the duration of a database helper in DB_CALL_LATENCY."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not METRICS_ENABLED:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_CALL_LATENCY.observe(time.perf_counter() - start, name)
+
+    return wrapper
+
+
+def init_app(app):
+    """Record count, latency and errors for every request handled by app."""
+    from flask import g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('request_started', None)
+        if started is None or not METRICS_ENABLED:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        if endpoint == 'metrics.metrics':
+            return response
+        HTTP_LATENCY.observe(time.perf_counter() - started, endpoint, request.method)
+        HTTP_REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        if response.status_code >= 500:
+            HTTP_ERRORS.inc(endpoint, request.method)
+        return response
@@ -0,0 +1,203 @@
+"""
+Migrations Module - Versioned schema changes
+Applies ordered migrations on top of the tables created by init_database
+"""
+
+import sqlite3
+from datetime import datetime
+from typing import Callable, List, Tuple, Union
+
+# Each migration is (version, description, steps). A step is either a SQL
+# statement or a callable taking the open connection.
+Step = Union[str, Callable[[sqlite3.Connection], None]]
+
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, 'Index open loans by patron', [
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_open_patron
+           ON borrow_records (patron_id) WHERE return_date IS NULL''',
+    ]),
+    (2, 'Index loans by book and return date', [
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_book_return
+           ON borrow_records (book_id, return_date)''',
+    ]),
+    (3, 'Index books by title', [
+        'CREATE INDEX IF NOT EXISTS idx_books_title ON books (title)',
+    ]),
+    (4, 'Index borrowing history by patron', [
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_patron_borrow_date
+           ON borrow_records (patron_id, borrow_date)''',
+    ]),
+    (5, 'Full-text search over book titles and authors', [
+        # The trigram tokenizer keeps case-insensitive substring matching
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+               title, author, content='books', content_rowid='id', tokenize='trigram'
+           )''',
+        '''CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+               INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+               INSERT INTO books_fts (books_fts, rowid, title, author)
+               VALUES ('delete', old.id, old.title, old.author);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN
+               INSERT INTO books_fts (books_fts, rowid, title, author)
+               VALUES ('delete', old.id, old.title, old.author);
+               INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+           END''',
+        "INSERT INTO books_fts (books_fts) VALUES ('rebuild')",
+    ]),
+    (6, 'Nightly late fee snapshots', [
+        '''CREATE TABLE IF NOT EXISTS fee_snapshots (
+               snapshot_date TEXT NOT NULL,
+               borrow_record_id INTEGER NOT NULL,
+               patron_id TEXT NOT NULL,
+               book_id INTEGER NOT NULL,
+               days_overdue INTEGER NOT NULL,
+               fee_amount REAL NOT NULL,
+               PRIMARY KEY (snapshot_date, borrow_record_id)
+           )''',
+    ]),
+    (7, 'Trigger-maintained active loan counters per patron and per book', [
+        '''CREATE TABLE IF NOT EXISTS patron_loans (
+               patron_id TEXT PRIMARY KEY,
+               active_loans INTEGER NOT NULL DEFAULT 0
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS book_loans (
+               book_id INTEGER PRIMARY KEY,
+               active_loans INTEGER NOT NULL DEFAULT 0
+           )''',
+        '''CREATE TRIGGER IF NOT EXISTS borrow_records_counters_insert
+           AFTER INSERT ON borrow_records WHEN new.return_date IS NULL BEGIN
+               INSERT INTO patron_loans (patron_id, active_loans) VALUES (new.patron_id, 1)
+                   ON CONFLICT (patron_id) DO UPDATE SET active_loans = active_loans + 1;
+               INSERT INTO book_loans (book_id, active_loans) VALUES (new.book_id, 1)
+                   ON CONFLICT (book_id) DO UPDATE SET active_loans = active_loans + 1;
+           END''',
+        # Covers returns, re-opened loans and moving an open loan between patrons or books
+        '''CREATE TRIGGER IF NOT EXISTS borrow_records_counters_update
+           AFTER UPDATE OF return_date, patron_id, book_id ON borrow_records BEGIN
+               UPDATE patron_loans SET active_loans = active_loans - 1
+                   WHERE patron_id = old.patron_id AND old.return_date IS NULL;
+               UPDATE book_loans SET active_loans = active_loans - 1
+                   WHERE book_id = old.book_id AND old.return_date IS NULL;
+               INSERT INTO patron_loans (patron_id, active_loans) SELECT new.patron_id, 1
+                   WHERE new.return_date IS NULL
+                   ON CONFLICT (patron_id) DO UPDATE SET active_loans = active_loans + 1;
+               INSERT INTO book_loans (book_id, active_loans) SELECT new.book_id, 1
+                   WHERE new.return_date IS NULL
+                   ON CONFLICT (book_id) DO UPDATE SET active_loans = active_loans + 1;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS borrow_records_counters_delete
+           AFTER DELETE ON borrow_records WHEN old.return_date IS NULL BEGIN
+               UPDATE patron_loans SET active_loans = active_loans - 1 WHERE patron_id = old.patron_id;
+               UPDATE book_loans SET active_loans = active_loans - 1 WHERE book_id = old.book_id;
+           END''',
+        '''INSERT INTO patron_loans (patron_id, active_loans)
+           SELECT patron_id, COUNT(*) FROM borrow_records WHERE return_date IS NULL GROUP BY patron_id''',
+        '''INSERT INTO book_loans (book_id, active_loans)
+           SELECT book_id, COUNT(*) FROM borrow_records WHERE return_date IS NULL GROUP BY book_id''',
+    ]),
+    (8, 'Integer epoch timestamps for borrow_records', [
+        # Generated from the ISO text columns, so every writer keeps them in sync
+        '''ALTER TABLE borrow_records ADD COLUMN borrow_ts INTEGER
+           GENERATED ALWAYS AS (CAST(strftime('%s', borrow_date) AS INTEGER)) VIRTUAL''',
+        '''ALTER TABLE borrow_records ADD COLUMN due_ts INTEGER
+           GENERATED ALWAYS AS (CAST(strftime('%s', due_date) AS INTEGER)) VIRTUAL''',
+        '''ALTER TABLE borrow_records ADD COLUMN return_ts INTEGER
+           GENERATED ALWAYS AS (CAST(strftime('%s', return_date) AS INTEGER)) VIRTUAL''',
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_open_due
+           ON borrow_records (due_ts) WHERE return_date IS NULL''',
+    ]),
+    (9, 'Index open loans by patron and due date for the overdue scanner', [
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_open_patron_due
+           ON borrow_records (patron_id, due_ts) WHERE return_date IS NULL''',
+    ]),
+    (10, 'Stored responses for Idempotency-Key retries', [
+        '''CREATE TABLE IF NOT EXISTS idempotency_keys (
+               key TEXT PRIMARY KEY,
+               fingerprint TEXT NOT NULL,
+               expires_at INTEGER NOT NULL,
+               status INTEGER,
+               content_type TEXT,
+               location TEXT,
+               flashes TEXT,
+               body BLOB
+           ) WITHOUT ROWID''',
+        '''CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires
+           ON idempotency_keys (expires_at)''',
+    ]),
+    (11, 'Catalog version bumped by every change to books', [
+        # Bumped in the writer's own transaction, so every process sees the change
+        '''CREATE TABLE IF NOT EXISTS catalog_version (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               version INTEGER NOT NULL
+           )''',
+        'INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)',
+        '''CREATE TRIGGER IF NOT EXISTS books_catalog_version_insert AFTER INSERT ON books BEGIN
+               UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS books_catalog_version_update AFTER UPDATE ON books BEGIN
+               UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS books_catalog_version_delete AFTER DELETE ON books BEGIN
+               UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+           END''',
+    ]),
+]
+
+
+def ensure_version_table(conn: sqlite3.Connection):
+    """Create the schema_version bookkeeping table if needed."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Return the highest applied migration version (0 for a fresh database)."""
+    ensure_version_table(conn)
+    version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+    return version or 0
+
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """
+    Apply every pending migration in order, each in its own transaction.
+
+    Returns:
+        int: the schema version after migrating
+    """
+    current = get_schema_version(conn)
+
+    for version, description, steps in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version <= current:
+            continue
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Another process may have applied it since current was read
+            applied = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+            if applied >= version:
+                conn.rollback()
+                current = applied
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('''
+                INSERT INTO schema_version (version, description, applied_at)
+                VALUES (?, ?, ?)
+            ''', (version, description, datetime.now().isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        current = version
+
+    return current
@@ -0,0 +1,935 @@
+import io
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import database
+import fee_engine
+import idempotency
+import metrics
+import profiling
+import suggest
+from bulk_returns import process_returns
+from cache import LRUCache
+from loan_counters import reconcile_loan_counters
+from catalog_io import import_books, export_books
+from query_stats import assert_max_queries, track_queries
+from library_service import (
+    add_book_to_catalog, search_books_in_catalog, get_catalog_page, search_books_in_catalog_page,
+    borrow_book_by_patron, return_book_by_patron, calculate_late_fee_for_book,
+    get_patron_status_report, compute_late_fee, get_overdue_loans_page, borrow_books_by_patron,
+    suggest_completions
+)
+from migrations import MIGRATIONS, get_schema_version, run_migrations
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Run each test against its own fresh database file."""
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "library.db"))
+    database.configure_pool()
+    database.init_database()
+    yield database.DATABASE
+    database.configure_pool()
+
+
+def helper_plan(helper, *args):
+    """EXPLAIN QUERY PLAN every statement a database helper actually runs (parameters bound as NULL)."""
+    with track_queries() as stats:
+        helper(*args)
+    conn = database.get_db_connection()
+    plans = []
+    for sql, _ in stats.statements:
+        if sql.split(None, 1)[0].upper() in ("SELECT", "WITH", "UPDATE", "DELETE"):
+            rows = conn.execute("EXPLAIN QUERY PLAN " + sql, (None,) * sql.count("?")).fetchall()
+            plans.append(" | ".join(row["detail"] for row in rows))
+    conn.close()
+    assert plans, f"{helper.__name__} ran no statements to explain"
+    return " || ".join(plans)
+
+
+# Connection Pool Tests
+
+def _acquire_in_thread(pool):
+    result = {}
+    def worker():
+        try:
+            conn = pool.acquire()
+            result["conn"] = conn
+            conn.close()
+        except sqlite3.Error as e:
+            result["error"] = e
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    return result
+
+def test_pool_reuses_thread_connection_until_outermost_release(temp_db):
+    pool = database.ConnectionPool(temp_db, 2, timeout=0.1)
+    outer = pool.acquire()
+    inner = pool.acquire()
+    assert inner is outer
+    inner.close()
+    assert pool._idle.qsize() == 0
+    outer.close()
+    assert pool._idle.qsize() == 1
+    assert _acquire_in_thread(pool)["conn"] is outer
+    pool.close()
+
+def test_pool_times_out_when_exhausted(temp_db):
+    pool = database.ConnectionPool(temp_db, 1, timeout=0.05)
+    conn = pool.acquire()
+    assert "Timed out" in str(_acquire_in_thread(pool)["error"])
+    conn.close()
+    assert "conn" in _acquire_in_thread(pool)
+    pool.close()
+
+def test_pool_drops_unhealthy_connections(temp_db):
+    pool = database.ConnectionPool(temp_db, 1, timeout=0.05)
+    stale = pool.acquire()
+    stale.close()
+    sqlite3.Connection.close(stale)
+    stale.last_used -= database.POOL_HEALTH_CHECK_INTERVAL
+    fresh = pool.acquire()
+    assert fresh is not stale
+    assert fresh.execute("SELECT 1").fetchone()[0] == 1 and pool._created == 1
+    fresh.close()
+    pool.close()
+
+def test_pool_recovers_after_failing_helpers(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "broken.db"))
+    monkeypatch.setattr(database, "POOL_SIZE", 1)
+    monkeypatch.setattr(database, "POOL_TIMEOUT", 0.05)
+    database.configure_pool()
+    try:
+        database.get_db_connection().close()
+        with sqlite3.connect(database.DATABASE) as other:
+            other.execute("DROP TABLE books")
+        for book_id in (1, 2):
+            with pytest.raises(sqlite3.OperationalError, match="no such table"):
+                database.get_book_by_id(book_id)
+        conn = database.get_db_connection()
+        database.get_db_connection()  # a lease that is never closed
+        database.release_connection(conn)
+        assert "conn" in _acquire_in_thread(database._get_pool())
+    finally:
+        database.configure_pool()
+
+
+# Migration Tests
+
+def test_migrations_reach_latest_version(temp_db):
+    conn = database.get_db_connection()
+    assert get_schema_version(conn) == max(m[0] for m in MIGRATIONS)
+    conn.close()
+
+def test_migrations_are_idempotent(temp_db):
+    database.init_database()
+    conn = database.get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0]
+    conn.close()
+    assert count == len(MIGRATIONS)
+
+def test_migrations_upgrade_existing_database(tmp_path):
+    conn = sqlite3.connect(tmp_path / "old.db")
+    conn.execute("CREATE TABLE books (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, "
+                 "author TEXT NOT NULL, isbn TEXT UNIQUE NOT NULL, total_copies INTEGER NOT NULL, "
+                 "available_copies INTEGER NOT NULL)")
+    conn.execute("CREATE TABLE borrow_records (id INTEGER PRIMARY KEY AUTOINCREMENT, patron_id TEXT NOT NULL, "
+                 "book_id INTEGER NOT NULL, borrow_date TEXT NOT NULL, due_date TEXT NOT NULL, return_date TEXT)")
+    conn.commit()
+    assert run_migrations(conn) == max(m[0] for m in MIGRATIONS)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    assert "idx_borrow_records_open_patron" in indexes
+
+def test_concurrent_init_database_on_new_file(tmp_path):
+    path = tmp_path / "fresh.db"
+    script = "import sys, database; database.DATABASE = sys.argv[1]; database.init_database()"
+    procs = [subprocess.Popen([sys.executable, "-c", script, str(path)], cwd=os.path.dirname(os.path.abspath(database.__file__)),
+                              stderr=subprocess.PIPE) for _ in range(4)]
+    errors = [proc.communicate(timeout=60)[1].decode() for proc in procs]
+    assert [proc.returncode for proc in procs] == [0] * 4, errors
+    conn = sqlite3.connect(path)
+    versions = [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+    conn.close()
+    assert versions == sorted(m[0] for m in MIGRATIONS)
+
+def test_first_connection_migrates_database(tmp_path, monkeypatch):
+    path = tmp_path / "old.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE books (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, "
+                 "author TEXT NOT NULL, isbn TEXT UNIQUE NOT NULL, total_copies INTEGER NOT NULL, "
+                 "available_copies INTEGER NOT NULL)")
+    conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+                 "VALUES ('Dune', 'Frank Herbert', '0000000000001', 2, 2)")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(database, "DATABASE", str(path))
+    database.configure_pool()
+    try:
+        assert database.get_patron_borrow_count("555555") == 0
+        assert [b["title"] for b in search_books_in_catalog("dune", "title")] == ["Dune"]
+        conn = database.get_db_connection()
+        assert get_schema_version(conn) == max(m[0] for m in MIGRATIONS)
+        conn.close()
+    finally:
+        database.configure_pool()
+
+
+# Query Plan Tests
+
+def test_borrow_count_reads_counter_by_primary_key(temp_db):
+    plan = helper_plan(database.get_patron_borrow_count, "123456")
+    assert "patron_loans USING PRIMARY KEY" in plan and "borrow_records" not in plan
+
+def test_borrowed_books_uses_index(temp_db):
+    plan = helper_plan(database.get_patron_borrowed_books, "123456")
+    assert "SEARCH br USING INDEX" in plan and "SCAN" not in plan and "TEMP B-TREE" not in plan
+
+def test_return_date_update_uses_index(temp_db):
+    plan = helper_plan(database.update_borrow_record_return_date, "123456", 1, datetime.now())
+    assert "USING INDEX" in plan and "SCAN" not in plan
+
+def test_book_lookups_use_index(temp_db):
+    assert "USING INTEGER PRIMARY KEY" in helper_plan(database.get_book_by_id, 1)
+    assert "USING INDEX" in helper_plan(database.get_book_by_isbn, "9780743273565")
+
+def test_catalog_ordering_uses_title_index(temp_db):
+    plan = helper_plan(database.get_all_books)
+    assert "idx_books_title" in plan and "TEMP B-TREE" not in plan
+
+def test_borrowing_history_uses_index(temp_db):
+    plan = helper_plan(database.get_patron_borrow_records, "123456")
+    assert "SEARCH br USING INDEX" in plan and "TEMP B-TREE" not in plan
+
+def test_fee_snapshot_reads_open_loans_index(temp_db):
+    plan = helper_plan(fee_engine.run_fee_snapshot)
+    assert "idx_borrow_records_open_due" in plan
+
+def test_epoch_columns_follow_text_dates(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 1, 1)
+    borrowed = datetime(2024, 3, 1, 10, 20, 30, 123456)
+    database.insert_borrow_record("555555", 1, borrowed, borrowed + timedelta(days=14))
+    database.update_borrow_record_return_date("555555", 1, borrowed + timedelta(days=3))
+    conn = database.get_db_connection()
+    row = conn.execute("SELECT borrow_ts, due_ts, return_ts FROM borrow_records").fetchone()
+    conn.close()
+    assert row["borrow_ts"] == database.to_epoch(borrowed.replace(microsecond=0))
+    assert row["due_ts"] - row["borrow_ts"] == 14 * database.SECONDS_PER_DAY
+    assert row["return_ts"] - row["borrow_ts"] == 3 * database.SECONDS_PER_DAY
+
+
+# Full-Text Search Tests
+
+def test_search_partial_case_insensitive(temp_db):
+    database.insert_book("The Great Gatsby", "F. Scott Fitzgerald", "9780743273565", 3, 3)
+    assert [b["isbn"] for b in search_books_in_catalog("GREAT gat", "title")] == ["9780743273565"]
+    assert len(search_books_in_catalog("zgera", "author")) == 1
+
+def test_search_short_term_falls_back_to_like(temp_db):
+    database.insert_book("1984", "George Orwell", "9780451524935", 1, 1)
+    assert len(search_books_in_catalog("98", "title")) == 1
+    assert search_books_in_catalog("%", "title") == []
+    database.insert_book("Éclair Über Alles", "Ännchen Ölberg", "0000000000002", 1, 1)
+    for term in ("éc", "ÉC", "ü"):
+        assert [b["title"] for b in search_books_in_catalog(term, "title")] == ["Éclair Über Alles"]
+    assert len(search_books_in_catalog("äN", "author")) == 1
+    assert len(search_books_in_catalog_page("ÜB", "title")["books"]) == 1
+
+def test_search_index_tracks_new_books(temp_db):
+    assert search_books_in_catalog("orwell", "author") == []
+    add_book_to_catalog("Animal Farm", "George Orwell", "9780451526342", 2)
+    assert len(search_books_in_catalog("orwell", "author")) == 1
+
+def test_search_respects_limit(temp_db):
+    for i in range(5):
+        database.insert_book(f"Dune {i}", "Frank Herbert", f"{i:013d}", 1, 1)
+    assert len(search_books_in_catalog("dune", "title", limit=3)) == 3
+
+
+# Pagination Tests
+
+def test_catalog_pages_forward_and_back(temp_db):
+    for i in range(7):
+        database.insert_book(f"Title {i}", "Author", f"{i:013d}", 1, 1)
+    first = get_catalog_page(page_size=3)
+    second = get_catalog_page(first["next_cursor"], page_size=3)
+    third = get_catalog_page(second["next_cursor"], page_size=3)
+    assert [b["title"] for b in first["books"]] == ["Title 0", "Title 1", "Title 2"]
+    assert first["prev_cursor"] is None
+    assert [b["title"] for b in third["books"]] == ["Title 6"]
+    assert third["next_cursor"] is None
+    back = get_catalog_page(third["prev_cursor"], page_size=3)
+    assert back["books"] == second["books"]
+
+def test_catalog_page_orders_duplicate_titles_by_id(temp_db):
+    for i in range(4):
+        database.insert_book("Same Title", "Author", f"{i:013d}", 1, 1)
+    first = get_catalog_page(page_size=2)
+    second = get_catalog_page(first["next_cursor"], page_size=2)
+    ids = [b["id"] for b in first["books"] + second["books"]]
+    assert ids == sorted(ids) and len(set(ids)) == 4
+
+def test_invalid_cursor_rejected(temp_db):
+    with pytest.raises(ValueError):
+        get_catalog_page("not-a-cursor")
+
+def test_search_pages(temp_db):
+    for i in range(5):
+        database.insert_book(f"Dune {i}", "Frank Herbert", f"{i:013d}", 1, 1)
+    first = search_books_in_catalog_page("dune", "title", page_size=4)
+    second = search_books_in_catalog_page("dune", "title", first["next_cursor"], page_size=4)
+    assert len(first["books"]) == 4 and [b["title"] for b in second["books"]] == ["Dune 4"]
+
+def test_catalog_page_uses_title_index(temp_db):
+    plan = helper_plan(database.get_books_page, ("M", 0))
+    assert "idx_books_title" in plan and "TEMP B-TREE" not in plan
+
+
+# Patron Status Report Tests
+
+def test_status_report_query_count_is_constant(temp_db):
+    for i in range(4):
+        database.insert_book(f"Book {i}", "Author", f"{i:013d}", 2, 2)
+        borrow_book_by_patron("555555", i + 1)
+    with assert_max_queries(2):
+        report = get_patron_status_report("555555")
+    assert report["borrow_count"] == 4
+
+def test_status_report_fees_for_every_loan(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 1, 1)
+    database.insert_book("Book B", "Author", "0000000000002", 1, 1)
+    now = datetime.now()
+    database.insert_borrow_record("555555", 1, now - timedelta(days=30), now - timedelta(days=16))
+    database.insert_borrow_record("555555", 2, now - timedelta(days=20), now - timedelta(days=3))
+    report = get_patron_status_report("555555")
+    assert [b["late_fee"] for b in report["borrowed_books"]] == [12.5, 1.5]
+    assert report["total_late_fee"] == 14.0
+
+
+# Batch Late Fee Tests
+
+@pytest.mark.parametrize("use_numpy", [True, False], ids=["numpy", "python"])
+def test_batch_fees_match_scalar_rules(use_numpy, monkeypatch):
+    if use_numpy:
+        assert fee_engine.np is not None, "numpy is listed in requirements.txt"
+    else:
+        monkeypatch.setattr(fee_engine, "np", None)
+    today = datetime(2024, 3, 1).date()
+    due_dates = [(datetime(2024, 3, 1) - timedelta(days=n, hours=3)).isoformat() for n in range(-3, 40)]
+    days, fees = fee_engine.compute_late_fees_batch(due_dates, today)
+    expected = [compute_late_fee(datetime.fromisoformat(d), today) for d in due_dates]
+    assert days == [e["days_overdue"] for e in expected]
+    assert fees == [e["fee_amount"] for e in expected]
+    epoch = [database.to_epoch(datetime.fromisoformat(d)) for d in due_dates]
+    assert fee_engine.compute_late_fees_batch(epoch, today) == (days, fees)
+
+def test_fee_snapshot_written_for_open_loans(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 2, 2)
+    now = datetime.now()
+    database.insert_borrow_record("555555", 1, now - timedelta(days=30), now - timedelta(days=16))
+    database.insert_borrow_record("666666", 1, now, now + timedelta(days=14))
+    summary = fee_engine.run_fee_snapshot()
+    assert summary["loans"] == 2 and summary["overdue"] == 1 and summary["total_fees"] == 12.5
+    fee_engine.run_fee_snapshot()
+    conn = database.get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM fee_snapshots").fetchone()[0] == 2
+    conn.close()
+
+
+# Borrow Transaction Tests
+
+def test_borrow_outcomes(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 1, 1)
+    now = datetime.now()
+    due = now + timedelta(days=14)
+    assert database.borrow_book_atomic("555555", 99, now, due, 5) == (database.BORROW_BOOK_NOT_FOUND, None)
+    outcome, book = database.borrow_book_atomic("555555", 1, now, due, 5)
+    assert outcome == database.BORROW_OK and book["available_copies"] == 1
+    assert database.borrow_book_atomic("666666", 1, now, due, 5)[0] == database.BORROW_NOT_AVAILABLE
+    assert borrow_book_by_patron("666666", 1) == (False, "This book is currently not available.")
+    assert borrow_book_by_patron("666666", 99) == (False, "Book not found.")
+
+def test_borrow_limit_allows_exactly_five_books(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 10, 10)
+    assert all(borrow_book_by_patron("555555", 1)[0] for _ in range(5))
+    ok, message = borrow_book_by_patron("555555", 1)
+    assert not ok and "maximum borrowing limit" in message
+    assert database.get_patron_borrow_count("555555") == 5
+    assert database.get_book_by_id(1)["available_copies"] == 5
+
+def test_concurrent_borrows_never_oversell(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 2, 2)
+    outcomes = []
+    barrier = threading.Barrier(8)
+    def borrow(patron_id):
+        barrier.wait()
+        outcomes.append(database.borrow_book_atomic(patron_id, 1, datetime.now(),
+                                                    datetime.now() + timedelta(days=14), 5)[0])
+    threads = [threading.Thread(target=borrow, args=(f"55555{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert outcomes.count(database.BORROW_OK) == 2
+    assert database.get_book_by_id(1)["available_copies"] == 0
+    conn = database.get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM borrow_records").fetchone()[0] == 2
+    conn.close()
+
+
+# Loan Counter Tests
+
+def test_loan_counters_follow_borrows_and_returns(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 3, 3)
+    borrow_book_by_patron("555555", 1)
+    borrow_book_by_patron("666666", 1)
+    return_book_by_patron("555555", 1)
+    assert database.get_patron_borrow_count("555555") == 0
+    assert database.get_patron_borrow_count("666666") == 1
+    conn = database.get_db_connection()
+    assert conn.execute("SELECT active_loans FROM book_loans WHERE book_id = 1").fetchone()[0] == 1
+    conn.close()
+    assert reconcile_loan_counters() == {"patrons": [], "books": [], "availability": [], "repaired": False}
+
+def test_reconcile_repairs_drifted_counters(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 2, 2)
+    borrow_book_by_patron("555555", 1)
+    conn = database.get_db_connection()
+    conn.execute("UPDATE patron_loans SET active_loans = 4")
+    conn.execute("UPDATE books SET available_copies = 2")
+    conn.commit()
+    conn.close()
+    report = reconcile_loan_counters(repair=True)
+    assert report["patrons"] == [{"patron_id": "555555", "expected": 1, "stored": 4}]
+    assert report["availability"] == [{"book_id": 1, "expected": 1, "stored": 2}]
+    assert database.get_patron_borrow_count("555555") == 1
+    assert database.get_book_by_id(1)["available_copies"] == 1
+    assert not reconcile_loan_counters()["patrons"]
+
+
+# Book Cache Tests
+
+def test_book_lookups_hit_cache(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 2, 2)
+    database.get_book_by_id(1)
+    hits = database.book_cache.hits
+    with assert_max_queries(0):
+        database.get_book_by_id(1)
+        database.get_book_by_isbn("0000000000001")
+    assert database.book_cache.hits == hits + 3
+
+def test_book_cache_invalidated_on_availability_change(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 2, 2)
+    assert database.get_book_by_id(1)["available_copies"] == 2
+    borrow_book_by_patron("555555", 1)
+    assert database.get_book_by_id(1)["available_copies"] == 1
+    database.update_book_availability(1, +1)
+    assert database.get_book_by_isbn("0000000000001")["available_copies"] == 2
+
+def test_lru_cache_evicts_and_expires():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+    expired = LRUCache(maxsize=2, ttl=0)
+    expired.set("a", 1)
+    assert expired.get("a") is None and expired.expirations == 1
+
+
+# Search Cache Tests
+
+def test_repeated_search_served_from_cache(temp_db):
+    database.insert_book("Dune", "Frank Herbert", "0000000000001", 2, 2)
+    assert [b["title"] for b in search_books_in_catalog("dune", "title")] == ["Dune"]
+    hits = database.search_cache.hits
+    with assert_max_queries(0):
+        search_books_in_catalog("  DUNE ", "title")
+        search_books_in_catalog("dune", "title")
+    assert database.search_cache.hits == hits + 2
+    assert "library_search_cache_hit_ratio" in metrics.REGISTRY.render()
+
+def test_catalog_changes_retire_cached_searches(temp_db):
+    assert search_books_in_catalog("dune", "title") == []
+    database.insert_book("Dune", "Frank Herbert", "0000000000001", 2, 2)
+    assert search_books_in_catalog("dune", "title")[0]["available_copies"] == 2
+    borrow_book_by_patron("555555", 1)
+    assert search_books_in_catalog("dune", "title")[0]["available_copies"] == 1
+    page = search_books_in_catalog_page("dune", "title")
+    database.update_book_availability(1, +1)
+    assert search_books_in_catalog_page("dune", "title")["books"][0]["available_copies"] == 2
+    assert page["books"][0]["available_copies"] == 1
+
+def test_other_process_writes_retire_cached_searches(temp_db):
+    database.insert_book("Dune", "Frank Herbert", "0000000000001", 2, 2)
+    assert search_books_in_catalog("dune", "title")[0]["available_copies"] == 2
+    # A plain connection stands in for another worker process sharing the file
+    other = sqlite3.connect(temp_db)
+    other.execute("UPDATE books SET available_copies = 1 WHERE id = 1")
+    other.commit()
+    other.close()
+    assert search_books_in_catalog("dune", "title")[0]["available_copies"] == 1
+    hits = database.search_cache.hits
+    search_books_in_catalog("dune", "title")
+    assert database.search_cache.hits == hits + 1
+
+def test_lru_cache_byte_bound():
+    cache = LRUCache(maxsize=10, ttl=60, maxbytes=10, sizeof=len)
+    for value in ("aaaa", "bbbb", "cccc"):
+        cache.set(value[0], value)
+    assert cache.get("a") is None and cache.get("c") == "cccc"
+    assert cache.stats()["bytes"] == 8 and cache.evictions == 1
+    cache.set("big", "x" * 11)
+    assert cache.get("big") is None
+
+
+# Suggest Tests
+
+def test_suggestions_ranked_by_borrow_count(temp_db):
+    database.insert_book("The Dune Messiah", "Frank Herbert", "0000000000001", 3, 3)
+    database.insert_book("Dune", "Frank Herbert", "0000000000002", 3, 3)
+    database.insert_book("Dubliners", "James Joyce", "0000000000003", 3, 3)
+    for patron in ("555555", "666666"):
+        borrow_book_by_patron(patron, 1)
+    borrow_book_by_patron("555555", 3)
+    assert [s["title"] for s in suggest_completions("Du")] == ["The Dune Messiah", "Dubliners", "Dune"]
+    assert [s["title"] for s in suggest_completions("dune ")] == ["The Dune Messiah", "Dune"]
+    authors = suggest_completions("her", "author")
+    assert authors == [{"author": "Frank Herbert", "books": 2, "borrows": 2}]
+    with pytest.raises(ValueError):
+        suggest_completions("du", "isbn")
+
+def test_inserted_books_are_suggested_without_rebuild(temp_db):
+    database.insert_book("Dune", "Frank Herbert", "0000000000001", 2, 2)
+    assert len(suggest_completions("d")) == 1
+    built_at = suggest.index.built_at
+    database.insert_book("Dracula", "Bram Stoker", "0000000000002", 2, 2)
+    with assert_max_queries(0):
+        assert [s["title"] for s in suggest_completions("d")] == ["Dracula", "Dune"]
+        assert suggest_completions("stok", "author")[0]["author"] == "Bram Stoker"
+    assert suggest.index.built_at == built_at
+
+def test_ranked_keys_top_matches_full_sort():
+    rng = random.Random(7)
+    words = ["ab", "abc", "abd", "b", "ba", "bab", "c"]
+    pairs = sorted((rng.choice(words) + rng.choice(words), ref) for ref in range(300) for _ in range(2))
+    ranks = {ref: rank for rank, ref in enumerate(rng.sample(range(300), 300))}
+    ranked = suggest.RankedKeys(pairs, ranks)
+    for prefix in ("", "a", "ab", "abd", "ba", "cc", "z"):
+        matches = {ref for key, ref in pairs if key.startswith(prefix)}
+        assert ranked.top(prefix, 10) == sorted(matches, key=ranks.get)[:10]
+
+def test_bulk_import_rebuilds_suggestions_in_background(temp_db):
+    database.insert_book("Dune", "Frank Herbert", "0000000000001", 2, 2)
+    assert len(suggest_completions("d")) == 1
+    database.insert_books_bulk([("Dracula", "Bram Stoker", "0000000000002", 2, 2)])
+    suggest_completions("d")  # answered from the current index; starts the rebuild
+    for _ in range(200):
+        if not suggest.index.stale:
+            break
+        time.sleep(0.01)
+    assert [s["title"] for s in suggest_completions("d")] == ["Dracula", "Dune"]
+
+def test_suggest_api(temp_db):
+    from app import create_app
+    client = create_app().test_client()
+    response = client.get("/api/suggest?q=great&type=title&limit=1")
+    assert response.status_code == 200
+    assert response.get_json()["suggestions"][0]["title"] == "The Great Gatsby"
+    assert client.get("/api/suggest?q=orw&type=author").get_json()["count"] == 1
+    assert client.get("/api/suggest?q=").status_code == 400
+    assert client.get("/api/suggest?q=great&type=isbn").status_code == 400
+
+
+# Bulk Import Tests
+
+def test_csv_import_validates_and_deduplicates(temp_db):
+    database.insert_book("Existing", "Author", "0000000000001", 1, 1)
+    feed = io.StringIO(
+        "title,author,isbn,total_copies\n"
+        "Existing Again,Author,0000000000001,1\n"
+        "New One,Author,0000000000002,2\n"
+        "New One Dup,Author,0000000000002,2\n"
+        ",Author,0000000000003,1\n"
+        "Bad Copies,Author,0000000000004,zero\n"
+        "New Two,Author,0000000000005,3\n"
+    )
+    report = import_books(feed, "csv", batch_size=2)
+    assert report["imported"] == 2 and report["rejected"] == 4
+    assert {r["line"] for r in report["rejections"]} == {2, 4, 5, 6}
+    assert database.get_book_by_isbn("0000000000005")["available_copies"] == 3
+
+def test_jsonl_import(temp_db):
+    feed = io.StringIO('{"title": "A", "author": "B", "isbn": "0000000000001", "total_copies": 1}\n'
+                       "\n"
+                       "not json\n")
+    report = import_books(feed, "jsonl")
+    assert report["imported"] == 1 and report["rejections"][0]["line"] == 3
+
+def test_import_stops_with_report_on_unreadable_file(temp_db):
+    rows = "".join(f"Title {i},Author,{i:013d},1\n" for i in range(1, 401))
+    feed = io.TextIOWrapper(io.BytesIO(("title,author,isbn,total_copies\n" + rows).encode() + b"\xff\xfe\n"),
+                            encoding="utf-8", newline="")
+    report = import_books(feed, "csv", batch_size=100)
+    assert "not valid UTF-8" in report["error"]
+    assert 0 < report["imported"] < 400
+    assert database.get_book_by_isbn(f"{report['imported']:013d}") is not None
+
+def test_import_api_rejects_unreadable_upload(temp_db):
+    from app import create_app
+    client = create_app().test_client()
+    response = client.post("/api/books/import", data=b"title,author,isbn,total_copies\n\xff\n",
+                           content_type="text/csv")
+    assert response.status_code == 400
+    assert response.get_json()["imported"] == 0 and "UTF-8" in response.get_json()["error"]
+
+def test_import_api_accepts_export_format_names(temp_db):
+    from app import create_app
+    client = create_app().test_client()
+    line = '{"title": "Dune", "author": "Frank Herbert", "isbn": "0000000000001", "total_copies": 2}\n'
+    response = client.post("/api/books/import?format=ndjson", data=line)
+    assert response.status_code == 200 and response.get_json()["imported"] == 1
+    upload = {"file": (io.BytesIO(line.replace("0001", "0002").encode()), "books.txt")}
+    assert client.post("/api/books/import?format=NDJSON", data=upload).get_json()["imported"] == 1
+    assert client.post("/api/books/import?format=xml", data=line).status_code == 400
+
+
+# Export Tests
+
+def test_export_streams_every_book_in_chunks(temp_db):
+    for i in range(5):
+        database.insert_book(f"Title {i}", "Author", f"{i:013d}", 1, 1)
+    chunks = list(export_books("jsonl", chunk_size=2))
+    assert len(chunks) == 3
+    assert "".join(chunks).count("\n") == 5
+
+def test_export_csv_round_trips_through_import(temp_db, tmp_path, monkeypatch):
+    database.insert_book("Title, with comma", "Author", "0000000000001", 2, 2)
+    exported = "".join(export_books("csv"))
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "copy.db"))
+    database.configure_pool()
+    database.init_database()
+    report = import_books(io.StringIO(exported, newline=""), "csv")
+    assert report["imported"] == 1
+    assert database.get_book_by_isbn("0000000000001")["title"] == "Title, with comma"
+
+
+# Bulk Return Tests
+
+def test_bulk_returns_match_open_loans(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 3, 1)
+    now = datetime.now()
+    database.insert_borrow_record("555555", 1, now - timedelta(days=30), now - timedelta(days=16))
+    database.insert_borrow_record("555555", 1, now - timedelta(days=2), now + timedelta(days=12))
+    returned_at = now.replace(microsecond=0).isoformat()
+    csv_text = ("patron_id,book_id,returned_at\n"
+                f"555555,1,{returned_at}\n555555,1,{returned_at}\n555555,1,\n666666,1,\n12,1,\n")
+    with assert_max_queries(9):
+        report = process_returns(io.StringIO(csv_text, newline=""), "csv", now=now)
+    assert (report["returned"], report["not_borrowed"], report["rejected"]) == (2, 2, 1)
+    assert [r.get("late_fee") for r in report["results"][:2]] == [12.5, 0.0]
+    assert report["total_late_fees"] == 12.5
+    assert database.get_book_by_id(1)["available_copies"] == 3
+    assert database.get_patron_borrow_count("555555") == 0
+
+def test_bulk_returns_normalize_and_check_return_times(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 3, 1)
+    now = datetime.now().replace(microsecond=0)
+    database.insert_borrow_record("555555", 1, now - timedelta(days=3), now + timedelta(days=11))
+    database.insert_borrow_record("666666", 1, now - timedelta(days=3), now + timedelta(days=11))
+    utc = (now - timedelta(days=1)).astimezone().astimezone(timezone.utc)
+    csv_text = ("patron_id,book_id,returned_at\n"
+                f"555555,1,{utc.isoformat().replace('+00:00', 'Z')}\n"
+                f"666666,1,{(now - timedelta(days=5)).isoformat()}\n"
+                f"666666,1,{(now + timedelta(days=1)).isoformat()}\n")
+    report = process_returns(io.StringIO(csv_text, newline=""), "csv", now=now)
+    assert [r["status"] for r in report["results"]] == ["returned", "rejected", "rejected"]
+    assert report["results"][0]["returned_at"] == (now - timedelta(days=1)).isoformat()
+    conn = database.get_db_connection()
+    return_date = conn.execute("SELECT return_date FROM borrow_records WHERE patron_id = '555555'").fetchone()[0]
+    conn.close()
+    assert return_date == (now - timedelta(days=1)).isoformat()
+    assert database.get_patron_borrow_count("666666") == 1
+
+def test_bulk_returns_api(temp_db):
+    from app import create_app
+    database.insert_book("Book A", "Author", "0000000000001", 1, 1)
+    client = create_app().test_client()
+    borrow_book_by_patron("555555", 1)
+    body = '{"patron_id": "555555", "book_id": 1}\n{"patron_id": "555555", "book_id": 2}\n'
+    response = client.post("/api/returns/batch", data=body, content_type="application/x-ndjson")
+    assert response.status_code == 200
+    assert [r["status"] for r in response.get_json()["results"]] == ["returned", "not_borrowed"]
+    assert client.post("/api/returns/batch", data=body).status_code == 400
+    assert client.post("/api/returns/batch?format=ndjson", data=body).status_code == 200
+    unreadable = client.post("/api/returns/batch", data=body.encode() + b"\xff\n", content_type="application/x-ndjson")
+    assert unreadable.status_code == 400 and "UTF-8" in unreadable.get_json()["error"]
+
+
+# Batch Checkout Tests
+
+def test_batch_checkout_reports_each_item(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 2, 2)
+    database.insert_book("Book B", "Author", "0000000000002", 1, 0)
+    with assert_max_queries(5):
+        result = borrow_books_by_patron("555555", [1, 999, 2, 1])
+    assert [item["success"] for item in result["items"]] == [True, False, False, True]
+    assert result["items"][1]["message"] == "Book not found."
+    assert result["borrowed"] == 2 and result["success"]
+    assert database.get_book_by_id(1)["available_copies"] == 0
+    assert database.get_patron_borrow_count("555555") == 2
+
+def test_batch_checkout_limit_applies_to_whole_cart(temp_db):
+    database.insert_book("Book A", "Author", "0000000000001", 10, 10)
+    for _ in range(3):
+        borrow_book_by_patron("555555", 1)
+    result = borrow_books_by_patron("555555", [1, 1, 1])
+    assert result["borrowed"] == 0
+    assert all("maximum borrowing limit" in item["message"] for item in result["items"])
+    assert database.get_book_by_id(1)["available_copies"] == 7
+    assert borrow_books_by_patron("555555", [1, 1])["borrowed"] == 2
+
+def test_batch_checkout_api(temp_db):
+    from app import create_app
+    database.insert_book("Book A", "Author", "0000000000001", 2, 2)
+    client = create_app().test_client()
+    response = client.post("/api/borrow/batch", json={"patron_id": "555555", "book_ids": [1, 2]})
+    assert response.status_code == 200
+    assert [item["success"] for item in response.get_json()["items"]] == [True, False]
+    assert client.post("/api/borrow/batch", json={"patron_id": "555555"}).status_code == 400
+    assert client.post("/api/borrow/batch", json={"patron_id": "12", "book_ids": [1]}).status_code == 400
+    for body in ([1, 2], "x", 5):
+        response = client.post("/api/borrow/batch", json=body)
+        assert response.status_code == 400
+        assert response.get_json()["error"] == "Request body must be a JSON object"
+
+
+# Idempotency Tests
+
+def test_retried_borrow_with_same_key_runs_once(temp_db):
+    from app import create_app
+    database.insert_book("Book A", "Author", "0000000000001", 3, 3)
+    client = create_app().test_client()
+    headers = {"Idempotency-Key": "kiosk-1-0001"}
+    first = client.post("/borrow", data={"patron_id": "555555", "book_id": "1"}, headers=headers)
+    retry = client.post("/borrow", data={"patron_id": "555555", "book_id": "1"}, headers=headers)
+    assert retry.status_code == first.status_code == 302
+    assert retry.headers["Idempotent-Replayed"] == "true" and "Idempotent-Replayed" not in first.headers
+    assert database.get_patron_borrow_count("555555") == 1
+    assert database.get_book_by_id(1)["available_copies"] == 2
+    assert "Successfully borrowed" in client.get("/catalog").get_data(as_text=True)
+
+def test_idempotency_key_reuse_and_expiry(temp_db):
+    from app import create_app
+    database.insert_book("Book A", "Author", "0000000000001", 3, 3)
+    client = create_app({"IDEMPOTENCY_TTL": 0}).test_client()
+    headers = {"Idempotency-Key": "cart-42"}
+    first = client.post("/api/borrow/batch", json={"patron_id": "555555", "book_ids": [1]}, headers=headers)
+    assert first.get_json()["borrowed"] == 1
+    # A zero TTL expires the key at once, so the same key runs the request again
+    again = client.post("/api/borrow/batch", json={"patron_id": "555555", "book_ids": [1]}, headers=headers)
+    assert "Idempotent-Replayed" not in again.headers and again.get_json()["borrowed"] == 1
+
+    client = create_app().test_client()
+    client.post("/api/borrow/batch", json={"patron_id": "666666", "book_ids": [1]}, headers=headers)
+    replay = client.post("/api/borrow/batch", json={"patron_id": "666666", "book_ids": [1]}, headers=headers)
+    assert replay.get_json()["borrowed"] == 1 and replay.headers["Idempotent-Replayed"] == "true"
+    mismatch = client.post("/api/borrow/batch", json={"patron_id": "666666", "book_ids": [1, 1]}, headers=headers)
+    assert mismatch.status_code == 422
+    assert database.get_book_by_id(1)["available_copies"] == 0
+    assert idempotency.purge_expired_keys(now=2 ** 40) == 1
+
+def test_idempotency_fingerprints_raw_bodies(temp_db):
+    from app import create_app
+    database.insert_book("Book A", "Author", "0000000000001", 3, 3)
+    client = create_app().test_client()
+    for patron in ("555555", "666666"):
+        borrow_book_by_patron(patron, 1)
+    headers = {"Idempotency-Key": "dropbox-7", "Content-Type": "application/x-ndjson"}
+    first = client.post("/api/returns/batch", data='{"patron_id": "555555", "book_id": 1}\n', headers=headers)
+    assert first.get_json()["returned"] == 1
+    # Same length, different patron: must not replay the first file's report
+    other = client.post("/api/returns/batch", data='{"patron_id": "666666", "book_id": 1}\n', headers=headers)
+    assert other.status_code == 422
+    replay = client.post("/api/returns/batch", data='{"patron_id": "555555", "book_id": 1}\n', headers=headers)
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert database.get_patron_borrow_count("666666") == 1
+
+def test_idempotency_in_progress_and_stale_reservations(temp_db):
+    from app import create_app
+    database.insert_book("Book A", "Author", "0000000000001", 3, 3)
+    app = create_app()
+    form = {"patron_id": "555555", "book_id": "1"}
+    with app.test_request_context("/borrow", method="POST", data=form):
+        from flask import request
+        fingerprint = idempotency.request_fingerprint(request)
+    # A worker still running (or just killed) holds the key for its lease
+    assert idempotency.reserve_key("kiosk-9", fingerprint, lease=60) is None
+    client = app.test_client()
+    busy = client.post("/borrow", data=form, headers={"Idempotency-Key": "kiosk-9"})
+    assert busy.status_code == 409
+    assert database.get_patron_borrow_count("555555") == 0
+
+    now = int(time.time())
+    assert idempotency.reserve_key("kiosk-9", fingerprint, lease=60, now=now + 61) is None
+    idempotency.store_response("kiosk-9", 302, None, "/catalog", [], b"", ttl=3600, now=now + 61)
+    stored = idempotency.reserve_key("kiosk-9", fingerprint, lease=60, now=now + 3600)
+    assert stored["status"] == 302 and stored["expires_at"] == now + 61 + 3600
+
+    # Once the lease has run out, a retry takes the key over and runs the request
+    idempotency.reserve_key("kiosk-10", fingerprint, lease=1, now=now - 5)
+    retry = client.post("/borrow", data=form, headers={"Idempotency-Key": "kiosk-10"})
+    assert retry.status_code == 302 and "Idempotent-Replayed" not in retry.headers
+    assert database.get_patron_borrow_count("555555") == 1
+
+
+# Overdue Scanner Tests
+
+def _seed_overdue_loans():
+    for i in range(3):
+        database.insert_book(f"Book {i}", "Author", f"{i:013d}", 5, 5)
+    now = datetime.now()
+    for patron_id, book_id, days_late in [("222222", 1, 10), ("111111", 2, 3), ("111111", 3, 20),
+                                          ("333333", 1, -2), ("222222", 2, 1)]:
+        due = now - timedelta(days=days_late)
+        database.insert_borrow_record(patron_id, book_id, due - timedelta(days=14), due)
+
+def test_overdue_pages_group_by_patron(temp_db):
+    _seed_overdue_loans()
+    first = get_overdue_loans_page(page_size=3)
+    assert [p["patron_id"] for p in first["patrons"]] == ["111111", "222222"]
+    assert [loan["days_overdue"] for loan in first["patrons"][0]["loans"]] == [20, 3]
+    assert first["patrons"][0]["total_late_fee"] == 15.0 + 1.5
+    second = get_overdue_loans_page(first["next_cursor"], page_size=3)
+    assert [(p["patron_id"], len(p["loans"])) for p in second["patrons"]] == [("222222", 1)]
+    assert second["next_cursor"] is None and second["as_of"] == first["as_of"]
+
+def test_overdue_scan_uses_patron_due_index(temp_db):
+    plan = helper_plan(database.get_overdue_loans, 2000000000, ("111111", 0, 0), 10)
+    assert "idx_borrow_records_open_patron_due" in plan and "TEMP B-TREE" not in plan
+
+def test_overdue_api_streams_ndjson(temp_db):
+    from app import create_app
+    _seed_overdue_loans()
+    client = create_app().test_client()
+    lines = client.get("/api/overdue?format=ndjson").get_data(as_text=True).splitlines()
+    assert [json.loads(line)["patron_id"] for line in lines] == ["111111", "222222"]
+    assert sum(len(p["loans"]) for p in map(json.loads, lines)) == 4
+    assert client.get("/api/overdue?cursor=bogus").status_code == 400
+
+
+# Metrics Tests
+
+def test_metrics_endpoint_reports_requests_and_db_helpers(temp_db):
+    from app import create_app
+    client = create_app().test_client()
+    before = metrics.HTTP_LATENCY.count("catalog.catalog", "GET")
+    client.get("/catalog")
+    client.get("/api/search?q=gatsby")
+    assert metrics.HTTP_LATENCY.count("catalog.catalog", "GET") == before + 1
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'library_http_requests_total{endpoint="api.search_books_api",method="GET",status="200"}' in body
+    assert 'library_db_call_duration_seconds_count{helper="search_books_page"}' in body
+    assert "library_book_cache_hits_total" in body
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Test.", ("name",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "x")
+    lines = histogram.render()
+    assert 'test_seconds_bucket{name="x",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{name="x",le="1"} 2' in lines
+    assert 'test_seconds_bucket{name="x",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{name="x"} 3' in lines
+
+def test_busy_errors_are_counted(temp_db):
+    holder = database.connect(temp_db, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    conn = database.connect(temp_db, factory=database.InstrumentedConnection, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 0")
+    before = metrics.DB_BUSY_ERRORS.value()
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("BEGIN IMMEDIATE")
+    assert metrics.DB_BUSY_ERRORS.value() == before + 1
+    assert "library_db_busy_errors_total" in metrics.REGISTRY.render()
+    holder.rollback()
+    holder.close()
+    conn.close()
+
+
+# Query Budget Tests
+
+def test_add_book_query_budget(temp_db):
+    with assert_max_queries(2):
+        add_book_to_catalog("Budget Book", "Author", "0000000000001", 1)
+
+def test_borrow_query_budget(temp_db):
+    database.insert_book("Budget Book", "Author", "0000000000001", 2, 2)
+    with assert_max_queries(5):
+        ok, _ = borrow_book_by_patron("555555", 1)
+    assert ok
+
+def test_return_query_budget(temp_db):
+    database.insert_book("Budget Book", "Author", "0000000000001", 2, 2)
+    borrow_book_by_patron("555555", 1)
+    with assert_max_queries(4):
+        ok, _ = return_book_by_patron("555555", 1)
+    assert ok
+
+def test_late_fee_query_budget(temp_db):
+    database.insert_book("Budget Book", "Author", "0000000000001", 2, 2)
+    borrow_book_by_patron("555555", 1)
+    with assert_max_queries(1):
+        calculate_late_fee_for_book("555555", 1)
+
+def test_search_query_budget(temp_db):
+    with assert_max_queries(1):
+        search_books_in_catalog("gatsby", "title")
+
+def test_assert_max_queries_reports_statements(temp_db):
+    with pytest.raises(AssertionError, match="SELECT \\* FROM books WHERE id = \\?"):
+        with assert_max_queries(0):
+            database.get_book_by_id(42)
+
+def test_repeated_queries_detected(temp_db):
+    with track_queries() as stats:
+        for book_id in range(100, 106):
+            database.get_book_by_id(book_id)
+    assert stats.repeated(5)[0][1] == 6
+
+
+# Profiling Tests
+
+def test_profiled_request_is_stored_and_listed(temp_db, tmp_path):
+    from app import create_app
+    client = create_app({"PROFILING_TOKEN": "token", "PROFILE_DIR": str(tmp_path / "profiles")}).test_client()
+    assert "X-Profile-Id" not in client.get("/catalog").headers
+    profile_id = client.get("/catalog", headers={"X-Profile": "token"}).headers["X-Profile-Id"]
+    listing = client.get("/admin/profiles", headers={"X-Profile": "token"}).get_json()
+    assert [p["name"] for p in listing["profiles"]] == [profile_id]
+    assert client.get("/admin/profiles").status_code == 404
+    # The token is only accepted in the header, never in a logged URL
+    assert client.get("/admin/profiles?token=token").status_code == 404
+    assert client.get("/admin/profiles", headers={"X-Profile": "tokem"}).status_code == 404
+    assert "X-Profile-Id" not in client.get("/catalog?__profile=token").headers
+
+def test_stack_sampler_collapses_stacks():
+    sampler = profiling.StackSampler()
+    done = []
+    worker = threading.Thread(target=lambda: done.append(sum(range(10 ** 7))))
+    worker.start()
+    sampler.sample_once()
+    worker.join()
+    assert any("<lambda>" in stack or "run" in stack for stack in sampler.samples)
+    assert sampler.collapsed().endswith("\n")
@@ -0,0 +1,138 @@
+"""
+Profiling Module - On-demand request profiling and stack sampling
+Lets an operator profile a single live request with cProfile, or sample the
+stacks of every thread for a few seconds, without restarting the app
+
+Profiling is off unless PROFILING_TOKEN (or LIBRARY_PROFILING_TOKEN) is set.
+A request is profiled when it carries the token in the X-Profile header (never
+the URL, which ends up in access logs); the pstats dump is written to
+PROFILE_DIR and its name is returned in the X-Profile-Id response header.
+"""
+
+import cProfile
+import hmac
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+PROFILE_HEADER = 'X-Profile'
+DEFAULT_PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'library_profiles')
+MAX_SAMPLE_SECONDS = 60.0
+
+
+def profile_dir(app) -> str:
+    path = app.config['PROFILE_DIR']
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def token_matches(app, supplied: Optional[str]) -> bool:
+    """True when profiling is enabled and the supplied token is the configured one."""
+    token = app.config.get('PROFILING_TOKEN')
+    if not token or not supplied:
+        return False
+    return hmac.compare_digest(supplied.encode(), token.encode())
+
+
+def list_profiles(app) -> List[Dict]:
+    """Stored pstats dumps and collapsed-stack samples, newest first."""
+    directory = profile_dir(app)
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith(('.prof', '.folded')):
+            stat = os.stat(os.path.join(directory, name))
+            entries.append({'name': name, 'bytes': stat.st_size, 'created': stat.st_mtime})
+    return sorted(entries, key=lambda e: e['created'], reverse=True)
+
+
+def profile_path(app, name: str) -> Optional[str]:
+    """Resolve a stored profile name to a path, refusing anything outside PROFILE_DIR."""
+    if not re.fullmatch(r'[\w.-]+\.(prof|folded)', name):
+        return None
+    path = os.path.join(profile_dir(app), name)
+    return path if os.path.isfile(path) else None
+
+
+class StackSampler:
+    """
+    Low-overhead sampling profiler built on sys._current_frames().
+
+    Every `interval` seconds it records the Python stack of each other thread;
+    the result is a count per collapsed stack ("outer;...;inner"), the input
+    format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter = Counter()
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def sample_once(self):
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != own:
+                self.samples[self._collapse(frame)] += 1
+
+    def run(self, seconds: float) -> Counter:
+        """Sample for `seconds` on the calling thread and return the stack counts."""
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            self.sample_once()
+            time.sleep(self.interval)
+        return self.samples
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+def run_sampler(app, seconds: float, interval: float = 0.005) -> str:
+    """Sample all threads for `seconds`, store the collapsed stacks and return the file name."""
+    sampler = StackSampler(interval)
+    sampler.run(min(seconds, MAX_SAMPLE_SECONDS))
+    name = f'sample-{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}.folded'
+    with open(os.path.join(profile_dir(app), name), 'w') as f:
+        f.write(sampler.collapsed())
+    return name
+
+
+def init_app(app):
+    """Profile requests that carry a valid profiling token."""
+    from flask import g, request
+
+    app.config.setdefault('PROFILING_TOKEN', os.environ.get('LIBRARY_PROFILING_TOKEN'))
+    app.config.setdefault('PROFILE_DIR', os.environ.get('LIBRARY_PROFILE_DIR', DEFAULT_PROFILE_DIR))
+
+    @app.before_request
+    def start_profiler():
+        if not app.config.get('PROFILING_TOKEN'):
+            return
+        supplied = request.headers.get(PROFILE_HEADER)
+        if supplied and token_matches(app, supplied):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def stop_profiler(response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        profiler.disable()
+        endpoint = (request.endpoint or 'unmatched').replace('.', '_')
+        name = f'request-{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}-{endpoint}.prof'
+        profiler.dump_stats(os.path.join(profile_dir(app), name))
+        response.headers['X-Profile-Id'] = name
+        return response
@@ -0,0 +1,131 @@
+"""
+Query Stats Module - SQL statement counting
+Counts the statements (and time spent executing them) issued by the current
+thread, for per-request query budgets and for locking query counts in tests
+
+    with assert_max_queries(2):
+        get_patron_status_report("123456")
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+# Warn when one request runs more statements than this, or repeats one statement this often
+QUERY_BUDGET = int(os.environ.get('LIBRARY_QUERY_BUDGET', '25'))
+REPEATED_QUERY_THRESHOLD = int(os.environ.get('LIBRARY_REPEATED_QUERY_THRESHOLD', '5'))
+
+_local = threading.local()
+
+
+class QueryStats:
+    """Statements recorded while a tracker is active."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.statements: List[Tuple[str, float]] = []
+
+    def record(self, sql: str, duration: float):
+        self.count += 1
+        self.total_time += duration
+        self.statements.append((' '.join(sql.split()), duration))
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Statements executed at least `threshold` times (a likely N+1 pattern)."""
+        counts = Counter(sql for sql, _ in self.statements)
+        return [(sql, n) for sql, n in counts.most_common() if n >= threshold]
+
+    def summary(self) -> str:
+        lines = [f'{self.count} queries in {self.total_time * 1000:.2f} ms']
+        lines.extend(f'  {duration * 1000:7.3f} ms  {sql}' for sql, duration in self.statements)
+        return '\n'.join(lines)
+
+
+def _trackers() -> List[QueryStats]:
+    trackers = getattr(_local, 'trackers', None)
+    if trackers is None:
+        trackers = _local.trackers = []
+    return trackers
+
+
+def is_tracking() -> bool:
+    """True when the current thread has at least one active tracker."""
+    return bool(getattr(_local, 'trackers', None))
+
+
+def record_query(sql: str, duration: float):
+    """Add a statement to every tracker active on this thread."""
+    for stats in _trackers():
+        stats.record(sql, duration)
+
+
+def start_tracking() -> QueryStats:
+    stats = QueryStats()
+    _trackers().append(stats)
+    return stats
+
+
+def stop_tracking(stats: QueryStats):
+    trackers = _trackers()
+    if stats in trackers:
+        trackers.remove(stats)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Count the statements executed on this thread inside the block (trackers nest)."""
+    stats = start_tracking()
+    try:
+        yield stats
+    finally:
+        stop_tracking(stats)
+
+
+@contextmanager
+def assert_max_queries(limit: int) -> Iterator[QueryStats]:
+    """Fail with the list of statements if the block runs more than `limit` queries."""
+    with track_queries() as stats:
+        yield stats
+    assert stats.count <= limit, f'Expected at most {limit} queries, got {stats.summary()}'
+
+
+def init_app(app):
+    """Track the queries of every request and log a warning when it goes over budget."""
+    from flask import g, request
+
+    app.config.setdefault('QUERY_BUDGET', QUERY_BUDGET)
+    app.config.setdefault('REPEATED_QUERY_THRESHOLD', REPEATED_QUERY_THRESHOLD)
+
+    @app.before_request
+    def start_query_tracking():
+        g.query_stats = start_tracking()
+
+    @app.teardown_request
+    def check_query_budget(exc):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return
+        stop_tracking(stats)
+
+        budget = app.config['QUERY_BUDGET']
+        if stats.count > budget:
+            app.logger.warning('%s %s ran %d queries (budget %d) in %.2f ms', request.method, request.path,
+                               stats.count, budget, stats.total_time * 1000)
+        for sql, count in stats.repeated(app.config['REPEATED_QUERY_THRESHOLD']):
+            app.logger.warning('%s %s repeated a query %d times (possible N+1): %s',
+                               request.method, request.path, count, sql)
+
+
+def timed_execute(execute, sql: str, *args):
+    """Run a connection's execute method and record it when tracking is on."""
+    if not is_tracking():
+        return execute(sql, *args)
+    start = time.perf_counter()
+    try:
+        return execute(sql, *args)
+    finally:
+        record_query(sql, time.perf_counter() - start)
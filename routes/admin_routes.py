@@ -0,0 +1,58 @@
+"""
+Admin Routes - Profiling results and the stack sampler
+"""
+
+import io
+import pstats
+
+from flask import Blueprint, Response, abort, current_app, jsonify, request, send_file
+import profiling
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+@admin_bp.before_request
+def require_profiling_token():
+    """Hide every admin endpoint unless the profiling token is supplied in the X-Profile header."""
+    if not profiling.token_matches(current_app, request.headers.get(profiling.PROFILE_HEADER)):
+        abort(404)
+
+@admin_bp.route('/profiles')
+def list_profiles():
+    """List stored request profiles and stack samples."""
+    return jsonify({'profiles': profiling.list_profiles(current_app)})
+
+@admin_bp.route('/profiles/<name>')
+def get_profile(name):
+    """
+    Download a stored profile.
+    
+    .prof files are pstats dumps; add ?format=text for the top functions by
+    cumulative time. .folded files are collapsed stacks for flamegraphs.
+    """
+    path = profiling.profile_path(current_app, name)
+    if path is None:
+        abort(404)
+    
+    if name.endswith('.prof') and request.args.get('format') == 'text':
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(40)
+        return Response(out.getvalue(), mimetype='text/plain')
+    
+    return send_file(path, as_attachment=True, download_name=name)
+
+@admin_bp.route('/sampler', methods=['POST'])
+def run_sampler():
+    """
+    Sample every thread's stack for ?seconds=N (default 5, max 60) and
+    return the collapsed stacks.
+    """
+    seconds = request.args.get('seconds', 5.0, type=float)
+    interval = request.args.get('interval', 0.005, type=float)
+    if seconds <= 0 or interval <= 0:
+        return jsonify({'error': 'seconds and interval must be positive'}), 400
+    
+    name = profiling.run_sampler(current_app, seconds, interval)
+    path = profiling.profile_path(current_app, name)
+    with open(path) as f:
+        body = f.read()
+    return Response(body, mimetype='text/plain', headers={'X-Profile-Id': name})
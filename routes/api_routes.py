@@ -2,8 +2,18 @@
 API Routes - JSON API endpoints
 """
 
-from flask import Blueprint, jsonify, request
-from library_service import calculate_late_fee_for_book, search_books_in_catalog
+import io
+import json
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from bulk_returns import process_returns
+from catalog_io import import_books, export_books, format_for_filename, normalize_format, FORMATS
+from idempotency import IDEMPOTENCY_HEADER
+from library_service import (
+    calculate_late_fee_for_book, search_books_in_catalog_page, get_overdue_loans_page, iter_overdue_patrons,
+    borrow_books_by_patron, suggest_completions,
+    DEFAULT_PAGE_SIZE, DEFAULT_SUGGEST_LIMIT
+)
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
@@ -19,21 +29,171 @@ def get_late_fee(patron_id, book_id):
 @api_bp.route('/search')
 def search_books_api():
     """
-    Search for books via API endpoint.
+    Search for books via API endpoint, one page at a time.
     Alternative API interface for R5: Book Search Functionality
+    
+    Pass the returned next_cursor / prev_cursor back as ?cursor= to move between pages.
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    cursor = request.args.get('cursor')
+    page_size = request.args.get('page_size', DEFAULT_PAGE_SIZE, type=int)
     
     if not search_term:
         return jsonify({'error': 'Search term is required'}), 400
     
     # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    try:
+        page = search_books_in_catalog_page(search_term, search_type, cursor, page_size)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
         'search_term': search_term,
         'search_type': search_type,
-        'results': books,
-        'count': len(books)
+        'results': page['books'],
+        'count': len(page['books']),
+        'page_size': page['page_size'],
+        'next_cursor': page['next_cursor'],
+        'prev_cursor': page['prev_cursor']
+    })
+
+@api_bp.route('/suggest')
+def suggest_api():
+    """
+    Search-as-you-type completions for a title or author prefix.
+    Served from an in-memory prefix index ranked by borrow count, so it does not query per keystroke.
+    """
+    prefix = request.args.get('q', '').strip()
+    suggest_type = request.args.get('type', 'title')
+    limit = request.args.get('limit', DEFAULT_SUGGEST_LIMIT, type=int)
+    
+    if not prefix:
+        return jsonify({'error': 'Search term is required'}), 400
+    
+    try:
+        suggestions = suggest_completions(prefix, suggest_type, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'q': prefix,
+        'type': suggest_type,
+        'suggestions': suggestions,
+        'count': len(suggestions)
     })
+
+@api_bp.route('/books/import', methods=['POST'])
+def import_books_api():
+    """
+    Bulk import books from a CSV or JSON Lines upload.
+    
+    Accepts a multipart 'file' field or a raw request body; the format comes
+    from ?format=csv|jsonl, the file name or the Content-Type.
+    """
+    stream, fmt = _uploaded_records()
+    if fmt not in FORMATS:
+        return jsonify({'error': f"Import format must be one of: {', '.join(FORMATS)}"}), 400
+    
+    # An unreadable file still gets its report: batches before the bad line are already imported
+    report = import_books(stream, fmt)
+    return jsonify(report), 400 if 'error' in report else 200
+
+@api_bp.route('/returns/batch', methods=['POST'])
+def bulk_returns_api():
+    """
+    Process a drop-box file of returns: CSV or JSON Lines records with
+    patron_id, book_id and an optional returned_at timestamp.
+    
+    Upload it the same way as /books/import. The response holds one result
+    per record, with the late fee for each returned book.
+    """
+    stream, fmt = _uploaded_records()
+    if fmt not in FORMATS:
+        return jsonify({'error': f"Returns format must be one of: {', '.join(FORMATS)}"}), 400
+    
+    report = process_returns(stream, fmt)
+    return jsonify(report), 400 if 'error' in report else 200
+
+def _uploaded_records():
+    """
+    Get the text stream and format of an uploaded records file.
+    
+    Accepts a multipart 'file' field or a raw request body; the format comes
+    from ?format=csv|jsonl (or ndjson, as on export), the file name or the
+    Content-Type.
+    """
+    requested = request.args.get('format')
+    upload = request.files.get('file')
+    if upload:
+        stream = upload.stream
+        fmt = normalize_format(requested) if requested else format_for_filename(upload.filename)
+    else:
+        # An Idempotency-Key check reads the body to fingerprint it, leaving it cached on the request
+        stream = io.BytesIO(request.get_data(cache=True)) if IDEMPOTENCY_HEADER in request.headers else request.stream
+        content_type = request.mimetype or ''
+        fmt = normalize_format(requested) if requested else (
+            'csv' if content_type == 'text/csv' else
+            'jsonl' if content_type in {'application/x-ndjson', 'application/jsonl'} else None
+        )
+    return io.TextIOWrapper(stream, encoding='utf-8', newline=''), fmt
+
+@api_bp.route('/books/export')
+def export_books_api():
+    """
+    Stream the whole catalog as CSV or NDJSON (?format=csv|ndjson).
+    
+    Rows are sent as they are read, so the response never sits in memory.
+    """
+    fmt = normalize_format(request.args.get('format', 'csv'))
+    if fmt is None:
+        return jsonify({'error': 'Export format must be csv or ndjson'}), 400
+    
+    mimetype, extension = ('text/csv', 'csv') if fmt == 'csv' else ('application/x-ndjson', 'ndjson')
+    return Response(
+        stream_with_context(export_books(fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=catalog.{extension}'}
+    )
+
+@api_bp.route('/overdue')
+def overdue_loans_api():
+    """
+    List open loans past their due date, grouped by patron, with late fees.
+    
+    Returns one page per request (pass next_cursor back as ?cursor=), or with
+    ?format=ndjson streams every overdue patron as one JSON line each.
+    """
+    if request.args.get('format') == 'ndjson':
+        lines = (json.dumps(patron) + '\n' for patron in iter_overdue_patrons())
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+    
+    cursor = request.args.get('cursor')
+    page_size = request.args.get('page_size', DEFAULT_PAGE_SIZE, type=int)
+    try:
+        page = get_overdue_loans_page(cursor, page_size)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(page)
+
+@api_bp.route('/borrow/batch', methods=['POST'])
+def borrow_batch_api():
+    """
+    Check out several books for one patron in one transaction.
+    
+    Expects JSON {"patron_id": "123456", "book_ids": [1, 2, 3]} and returns a
+    result per book; the borrowing limit is checked against the whole cart.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    patron_id = str(data.get('patron_id', '')).strip()
+    book_ids = data.get('book_ids')
+    if not isinstance(book_ids, list):
+        return jsonify({'error': 'book_ids must be a list of book IDs'}), 400
+    
+    result = borrow_books_by_patron(patron_id, book_ids)
+    return jsonify(result), 200 if result['items'] else 400
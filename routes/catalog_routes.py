@@ -3,8 +3,7 @@ Catalog Routes - Book catalog related endpoints
 """
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash
-from database import get_all_books
-from library_service import add_book_to_catalog
+from library_service import add_book_to_catalog, get_catalog_page, DEFAULT_PAGE_SIZE
 
 catalog_bp = Blueprint('catalog', __name__)
 
@@ -16,11 +15,20 @@ def index():
 @catalog_bp.route('/catalog')
 def catalog():
     """
-    Display all books in the catalog.
+    Display the catalog one page at a time.
     Implements R2: Book Catalog Display
     """
-    books = get_all_books()
-    return render_template('catalog.html', books=books)
+    page_size = request.args.get('page_size', DEFAULT_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor')
+    
+    try:
+        page = get_catalog_page(cursor, page_size)
+    except ValueError as e:
+        flash(str(e), 'error')
+        page = get_catalog_page(None, page_size)
+    
+    return render_template('catalog.html', books=page['books'], page_size=page['page_size'],
+                           next_cursor=page['next_cursor'], prev_cursor=page['prev_cursor'])
 
 @catalog_bp.route('/add_book', methods=['GET', 'POST'])
 def add_book():
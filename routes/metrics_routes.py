@@ -0,0 +1,13 @@
+"""
+Metrics Routes - Prometheus scrape endpoint
+"""
+
+from flask import Blueprint, Response
+from metrics import REGISTRY
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Expose collected metrics in the Prometheus text format."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
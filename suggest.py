@@ -0,0 +1,323 @@
+"""
+Suggest Module - In-memory prefix index for search-as-you-type
+Sorted arrays of normalized title and author keys, searched with bisect and
+ranked by how often each book has been borrowed. A min segment tree over each
+array's ranks gives the top N of a prefix range in O(N log n), however many
+keys the prefix matches.
+
+The index is built from the books table on first use, extended in place when
+insert_book adds a book, and rebuilt in a background thread after bulk imports
+and every SUGGEST_REFRESH_SECONDS so the borrow counts behind the ranking stay
+current. Lookups keep using the previous index until the new one is swapped in.
+"""
+
+import bisect
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import database
+
+SUGGEST_TYPES = ('title', 'author')
+
+# Seconds before the index is rebuilt to pick up new borrow counts
+SUGGEST_REFRESH_SECONDS = float(os.environ.get('LIBRARY_SUGGEST_REFRESH', '600'))
+
+# Keys added since the last build are kept in a small sorted side list; past
+# this many a background rebuild folds them into the ranked arrays
+MAX_PENDING_KEYS = 5000
+
+_ARTICLES = ('the ', 'a ', 'an ')
+_MAX_CHAR = '\U0010ffff'
+
+BOOK_BORROWS = '''
+    SELECT b.id, b.title, b.author, COALESCE(c.n, 0) AS borrows
+    FROM books b
+    LEFT JOIN (SELECT book_id, COUNT(*) AS n FROM borrow_records GROUP BY book_id) c ON c.book_id = b.id
+'''
+
+
+def normalize(text: str) -> str:
+    """Lowercase and collapse whitespace so keys compare the way users type."""
+    return ' '.join(text.lower().split())
+
+
+def title_keys(title: str) -> List[str]:
+    """Keys for a title: the title itself and, for "The Hobbit", also "hobbit"."""
+    key = normalize(title)
+    for article in _ARTICLES:
+        if key.startswith(article) and len(key) > len(article):
+            return [key, key[len(article):]]
+    return [key]
+
+
+def author_keys(author: str) -> List[str]:
+    """Keys for an author: the full name and every trailing run of words, so "orw" finds George Orwell."""
+    words = normalize(author).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def _title_rank(book: Dict) -> Tuple:
+    return (-book['borrows'], book['title'].lower(), book['id'])
+
+
+def _author_rank(author: Dict) -> Tuple:
+    return (-author['borrows'], author['author'].lower())
+
+
+class RankedKeys:
+    """
+    Sorted keys with their references and a min segment tree over their ranks.
+
+    Leaf i holds rank * size + i, where rank 0 is the most borrowed entry, so
+    the minimum of a range names both the best rank and the key holding it.
+    """
+
+    def __init__(self, pairs: List[Tuple[str, Hashable]], ranks: Dict[Hashable, int]):
+        self.keys = [key for key, _ in pairs]
+        self.refs = [ref for _, ref in pairs]
+        size = 1
+        while size < len(pairs):
+            size *= 2
+        self.size = size
+        self.empty = (len(ranks) + 1) * size
+        tree = [self.empty] * (2 * size)
+        tree[size:size + len(pairs)] = [ranks[ref] * size + i for i, ref in enumerate(self.refs)]
+        for node in range(size - 1, 0, -1):
+            left, right = tree[2 * node], tree[2 * node + 1]
+            tree[node] = left if left < right else right
+        self.tree = tree
+
+    def _range_min(self, lo: int, hi: int) -> int:
+        tree = self.tree
+        best = self.empty
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                if tree[lo] < best:
+                    best = tree[lo]
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                if tree[hi] < best:
+                    best = tree[hi]
+            lo >>= 1
+            hi >>= 1
+        return best
+
+    def top(self, prefix: str, limit: int) -> List[Hashable]:
+        """Distinct references of the best-ranked keys starting with prefix, best first."""
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + _MAX_CHAR, lo)
+        heap = [(self._range_min(lo, hi), lo, hi)] if lo < hi else []
+        seen = set()
+        refs = []
+        while heap and len(refs) < limit:
+            code, lo, hi = heapq.heappop(heap)
+            at = code % self.size
+            ref = self.refs[at]
+            if ref not in seen:
+                seen.add(ref)
+                refs.append(ref)
+            if lo < at:
+                heapq.heappush(heap, (self._range_min(lo, at), lo, at))
+            if at + 1 < hi:
+                heapq.heappush(heap, (self._range_min(at + 1, hi), at + 1, hi))
+        return refs
+
+
+class PrefixIndex:
+    """
+    Ranked key arrays per suggest type, plus unranked keys added since the last build.
+
+    Title keys reference a book id and author keys a normalized author name.
+    Builds assemble new arrays without holding the lock and swap them in, so
+    lookups are never blocked by a rebuild. All access takes a lock, so one
+    index can be shared by threaded Flask workers.
+    """
+
+    def __init__(self):
+        self._ranked: Dict[str, RankedKeys] = {t: RankedKeys([], {}) for t in SUGGEST_TYPES}
+        self._added: Dict[str, List[Tuple[str, Hashable]]] = {t: [] for t in SUGGEST_TYPES}
+        self._books: Dict[int, Dict] = {}
+        self._authors: Dict[str, Dict] = {}
+        self._pending: Optional[List[Optional[Dict]]] = None
+        self._lock = threading.Lock()
+        self.database: Optional[str] = None
+        self.built_at = 0.0
+        self.stale = True
+
+    def needs_refresh(self) -> bool:
+        return self.stale or time.monotonic() - self.built_at >= SUGGEST_REFRESH_SECONDS
+
+    def build(self, conn, path: str) -> None:
+        """Replace the index contents with every book in the database at path and its borrow count."""
+        with self._lock:
+            self._pending = []
+        try:
+            books, authors, ranked = self._read(conn)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            self._books = books
+            self._authors = authors
+            self._ranked = ranked
+            self._added = {t: [] for t in SUGGEST_TYPES}
+            pending, self._pending = self._pending, None
+            self.database = path
+            self.built_at = time.monotonic()
+            self.stale = False
+            for book in pending:
+                if book is not None:
+                    self._add_locked(book)
+            # A bulk insert during the build may have been missed by it
+            if None in pending:
+                self.stale = True
+
+    def _read(self, conn):
+        books: Dict[int, Dict] = {}
+        authors: Dict[str, Dict] = {}
+        pairs: Dict[str, list] = {t: [] for t in SUGGEST_TYPES}
+        for row in conn.execute(BOOK_BORROWS):
+            book = {'id': row['id'], 'title': row['title'], 'author': row['author'], 'borrows': row['borrows']}
+            books[book['id']] = book
+            pairs['title'].extend((key, book['id']) for key in title_keys(book['title']))
+            name = normalize(book['author'])
+            entry = authors.get(name)
+            if entry is None:
+                authors[name] = {'author': book['author'], 'books': 1, 'borrows': book['borrows']}
+                pairs['author'].extend((key, name) for key in author_keys(book['author']))
+            else:
+                entry['books'] += 1
+                entry['borrows'] += book['borrows']
+
+        title_ranks = {book_id: rank for rank, book_id in
+                       enumerate(sorted(books, key=lambda book_id: _title_rank(books[book_id])))}
+        author_ranks = {name: rank for rank, name in
+                        enumerate(sorted(authors, key=lambda name: _author_rank(authors[name])))}
+        ranked = {}
+        for suggest_type, ranks in (('title', title_ranks), ('author', author_ranks)):
+            pairs[suggest_type].sort()
+            ranked[suggest_type] = RankedKeys(pairs[suggest_type], ranks)
+        return books, authors, ranked
+
+    def add_book(self, book: Dict) -> None:
+        """Insert one new book ({id, title, author}) without rebuilding."""
+        with self._lock:
+            if self._pending is not None:
+                # A build is reading the table; replay once it has swapped in
+                self._pending.append(book)
+            elif self.database == database.DATABASE:
+                self._add_locked(book)
+
+    def invalidate(self) -> None:
+        """Schedule a rebuild, e.g. after a bulk import."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(None)
+            self.stale = True
+
+    def _add_locked(self, book: Dict) -> None:
+        if book['id'] in self._books:
+            return
+        book = {'id': book['id'], 'title': book['title'], 'author': book['author'], 'borrows': 0}
+        self._books[book['id']] = book
+        for key in title_keys(book['title']):
+            bisect.insort(self._added['title'], (key, book['id']))
+        name = normalize(book['author'])
+        entry = self._authors.get(name)
+        if entry is None:
+            self._authors[name] = {'author': book['author'], 'books': 1, 'borrows': 0}
+            for key in author_keys(book['author']):
+                bisect.insort(self._added['author'], (key, name))
+        else:
+            entry['books'] += 1
+        if len(self._added['title']) + len(self._added['author']) > MAX_PENDING_KEYS:
+            self.stale = True
+
+    def suggest(self, prefix: str, suggest_type: str, limit: int) -> List[Dict]:
+        """Return up to limit entries with a key starting with prefix, most borrowed first."""
+        prefix = normalize(prefix)
+        with self._lock:
+            entries, rank = (self._books, _title_rank) if suggest_type == 'title' else (self._authors, _author_rank)
+            refs = self._ranked[suggest_type].top(prefix, limit)
+            added = self._added[suggest_type]
+            if added:
+                lo = bisect.bisect_left(added, (prefix,))
+                hi = bisect.bisect_left(added, (prefix + _MAX_CHAR,), lo)
+                if lo < hi:
+                    refs = list(dict.fromkeys(refs + [ref for _, ref in added[lo:hi]]))
+                    refs = heapq.nsmallest(limit, refs, key=lambda ref: rank(entries[ref]))
+            return [dict(entries[ref]) for ref in refs]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'books': len(self._books),
+                'authors': len(self._authors),
+                'title_keys': len(self._ranked['title'].keys) + len(self._added['title']),
+                'author_keys': len(self._ranked['author'].keys) + len(self._added['author']),
+                'database': self.database,
+            }
+
+
+index = PrefixIndex()
+_build_lock = threading.Lock()
+
+
+def rebuild_index() -> None:
+    """Rebuild the shared index from the current database and swap it in."""
+    path = database.DATABASE
+    conn = database.get_db_connection()
+    try:
+        index.build(conn, path)
+    finally:
+        conn.close()
+
+
+def _rebuild_in_background() -> None:
+    if not _build_lock.acquire(blocking=False):
+        return  # a rebuild is already running
+
+    def run():
+        try:
+            rebuild_index()
+        except sqlite3.Error:
+            pass  # keep serving the current index; the next lookup retries
+        finally:
+            _build_lock.release()
+
+    threading.Thread(target=run, name='suggest-index-rebuild', daemon=True).start()
+
+
+def get_index() -> PrefixIndex:
+    """
+    Return the shared index.
+
+    The first lookup against a database builds the index in the request;
+    after that, stale or expired indexes are rebuilt in the background.
+    """
+    if index.database != database.DATABASE:
+        with _build_lock:
+            if index.database != database.DATABASE:
+                rebuild_index()
+    elif index.needs_refresh():
+        _rebuild_in_background()
+    return index
+
+
+def _on_books_inserted(books: Optional[List[Dict]]) -> None:
+    if books is None:
+        index.invalidate()
+        return
+    for book in books:
+        index.add_book(book)
+
+
+database.book_insert_listeners.append(_on_books_inserted)